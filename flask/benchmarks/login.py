@@ -0,0 +1,79 @@
+"""Measure login throughput and the latency other endpoints see meanwhile.
+
+Run against a live deployment, for example:
+
+    python benchmarks/login.py --url http://localhost:80 --password $ROOT_USER_PASSWORD
+"""
+import argparse
+import json
+import statistics
+import threading
+import time
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+
+def post(url, body):
+    request = Request(url, json.dumps(body).encode('utf-8'), {'Content-Type': 'application/json'})
+    try:
+        with urlopen(request) as response:
+            return response.status
+    except HTTPError as error:
+        return error.code
+
+
+def get(url):
+    try:
+        with urlopen(url) as response:
+            return response.status
+    except HTTPError as error:
+        return error.code
+
+
+def hammer(function, args, deadline, results):
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        status = function(*args)
+        results.append((status, time.perf_counter() - start))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--url', default='http://localhost:80')
+    parser.add_argument('--username', default='root')
+    parser.add_argument('--password', required=True)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--probe', default='/apispec_1.json',
+                        help='a cheap endpoint whose latency is sampled during the burst')
+    args = parser.parse_args()
+
+    deadline = time.perf_counter() + args.seconds
+    logins, probes = [], []
+    body = {'username': args.username, 'password': args.password}
+    threads = [
+        threading.Thread(target=hammer, args=(post, (args.url + '/auth/login', body), deadline, logins))
+        for i in range(args.clients)
+    ]
+    threads.append(threading.Thread(target=hammer, args=(get, (args.url + args.probe,), deadline, probes)))
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    for name, results in (('login', logins), ('probe', probes)):
+        latencies = sorted(duration for status, duration in results)
+        statuses = {}
+        for status, duration in results:
+            statuses[status] = statuses.get(status, 0) + 1
+        if not latencies:
+            continue
+        print('%s: %.1f requests/s, statuses %s' % (name, len(results) / args.seconds, statuses))
+        print('    p50 %.1fms  p99 %.1fms' % (
+            statistics.median(latencies) * 1000,
+            latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""Check that the hot membership and hierarchy lookups are planned as index scans.
+
+Builds the schema in a scratch postgres schema, seeds it with a large
+dataset, applies the migrations and EXPLAINs each lookup. Exits non-zero if
+any of them would scan a whole table. Run it inside the flask container:
+
+    docker-compose exec flask python benchmarks/plans.py
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, text  # noqa: E402
+from sqlalchemy.schema import CreateTable  # noqa: E402
+
+from project.api.v1.dbs.sql import migrations, models  # noqa: E402
+
+SCHEMA = 'plans_check'
+
+LOOKUPS = {
+    # Principal.load
+    'memberships of a user': (
+        'SELECT "user".username, "group".name, "group".level FROM "user" '
+        'LEFT OUTER JOIN association ON association._user = "user".username '
+        'LEFT OUTER JOIN "group" ON "group".name = association._group '
+        "WHERE \"user\".username = 'user50000'",
+        'ix_association__user',
+    ),
+    # deleting a user checks for memberships which still refer to them
+    'memberships to delete': (
+        "DELETE FROM association WHERE _user = 'user50000'",
+        'ix_association__user',
+    ),
+    # deleting a group checks for groups which it still manages
+    'groups a group manages': (
+        "SELECT name FROM \"group\" WHERE manager = 'group42'",
+        'ix_group_manager',
+    ),
+}
+
+
+def uri():
+    return 'postgresql://%s:%s@postgres/%s?port=%s' % (
+        os.environ['POSTGRES_USER'],
+        os.environ['POSTGRES_PASSWORD'],
+        os.environ['POSTGRES_DB'],
+        os.environ['POSTGRES_PORT'],
+    )
+
+
+def seed(connection, users, groups, memberships):
+    # tables without their indexes - the migrations must add those
+    for table in models.db.Model.metadata.sorted_tables:
+        connection.execute(CreateTable(table))
+    connection.execute(text(
+        "INSERT INTO \"user\" SELECT 'user' || i, 'x' FROM generate_series(1, :n) i"
+    ), n=users)
+    # group i is managed by group i / 10 - a tree ten groups wide
+    connection.execute(text(
+        "INSERT INTO \"group\" SELECT 'group' || i, length(i::text), "
+        "CASE WHEN i > 1 THEN 'group' || (i / 10) END FROM generate_series(1, :n) i"
+    ), n=groups)
+    # spread each user's memberships over distinct groups
+    per_user = max(1, memberships // users)
+    connection.execute(text(
+        "INSERT INTO association (_group, _user) "
+        "SELECT DISTINCT 'group' || ((u * 7 + k * 101) % :groups + 1), 'user' || u "
+        "FROM generate_series(1, :users) u, generate_series(0, :k) k"
+    ), groups=groups, users=users, k=per_user - 1)
+    connection.execute(text('ANALYZE'))
+
+
+def scans(plan):
+    yield plan
+    for child in plan.get('Plans', ()):
+        yield from scans(child)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--uri', default=None, help='defaults to the application database')
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--groups', type=int, default=1000)
+    parser.add_argument('--memberships', type=int, default=1000000)
+    parser.add_argument('--keep', action='store_true', help='leave the scratch schema behind')
+    args = parser.parse_args()
+
+    engine = create_engine(args.uri or uri(), connect_args={'options': '-c search_path=%s' % SCHEMA})
+    failed = False
+    with engine.connect() as connection:
+        connection = connection.execution_options(isolation_level='AUTOCOMMIT')
+        connection.execute(text('DROP SCHEMA IF EXISTS %s CASCADE' % SCHEMA))
+        connection.execute(text('CREATE SCHEMA %s' % SCHEMA))
+        try:
+            start = time.perf_counter()
+            seed(connection, args.users, args.groups, args.memberships)
+            print('seeded in %.1fs' % (time.perf_counter() - start))
+            start = time.perf_counter()
+            applied = migrations.upgrade(engine)
+            print('applied %s in %.1fs' % (', '.join(applied), time.perf_counter() - start))
+            for name, (query, index) in LOOKUPS.items():
+                plan = connection.execute(text('EXPLAIN (FORMAT JSON) ' + query)).scalar()
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                nodes = list(scans(plan[0]['Plan']))
+                used = [n for n in nodes if n.get('Index Name') == index]
+                full = [n['Relation Name'] for n in nodes if n['Node Type'] == 'Seq Scan']
+                ok = used and not full
+                failed = failed or not ok
+                print('%s %s: %s' % ('ok  ' if ok else 'FAIL', name, ', '.join(
+                    '%s on %s' % (n['Node Type'], n.get('Index Name') or n.get('Relation Name'))
+                    for n in nodes if 'Relation Name' in n
+                )))
+        finally:
+            if not args.keep:
+                connection.execute(text('DROP SCHEMA %s CASCADE' % SCHEMA))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
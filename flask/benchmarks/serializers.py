@@ -0,0 +1,87 @@
+"""Compare encode time and bytes on the wire of each response format and compression.
+
+Uses payloads shaped like a page of ``/logs`` and of ``/auth/tokens``. Run
+it where the application's environment and optional backends are installed:
+
+    docker-compose exec flask python benchmarks/serializers.py
+"""
+import argparse
+import base64
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from project.api.v1.utils import serial  # noqa: E402
+
+
+def logs(count):
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    endpoints = ['auth.login', 'auth.tokens', 'logs.get', 'user.create', 'group.create']
+    return {
+        'logs': [{
+            'time': (start + timedelta(milliseconds=i * 37)).isoformat(),
+            'ip': '10.0.%s.%s' % (random.randrange(256), random.randrange(256)),
+            'code': random.choice([200, 200, 200, 201, 400, 401, 404, 500]),
+            'endpoint': random.choice(endpoints),
+        } for i in range(count)],
+        'cursor': '1767225600.0:3',
+    }
+
+
+def tokens(count):
+    now = int(time.time())
+    result = []
+    for i in range(count):
+        data = {
+            'iat': now, 'nbf': now, 'exp': now + 900, 'jti': str(uuid.uuid4()),
+            'identity': 'user%s' % i, 'fresh': False, 'type': 'access',
+            'user_claims': {'groups': {'staff': 2, 'ops': 3}, 'level': 2, 'version': [4, 1]},
+        }
+        # a signed token is about three times the size of its claims
+        token = '.'.join(base64.urlsafe_b64encode(os.urandom(n)).decode('ascii') for n in (27, 230, 32))
+        result.append({'token': token, 'data': data})
+    return {'tokens': result, 'cursor': None}
+
+
+def measure(function, *args, repeat=20):
+    best = float('inf')
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--count', type=int, default=1000, help='items per payload')
+    args = parser.parse_args()
+
+    formats = {'json (flask)': serial.flask_json.dumps}
+    if serial.orjson is not None:
+        formats['json (orjson)'] = serial.orjson.dumps
+    if serial.ujson is not None:
+        formats['json (ujson)'] = serial.ujson.dumps
+    if serial.msgpack is not None:
+        formats['msgpack'] = serial._msgpack
+    serializer = serial.Serializer()
+
+    for name, payload in (('logs', logs(args.count)), ('tokens', tokens(args.count))):
+        print('%s (%s items)' % (name, args.count))
+        for format, dumps in formats.items():
+            seconds, body = measure(dumps, payload)
+            if isinstance(body, str):
+                body = body.encode('utf-8')
+            print('    %-14s encode %7.2fms  %8d bytes' % (format, seconds * 1000, len(body)))
+            for encoding, compress in serializer.encodings.items():
+                seconds, compressed = measure(compress, body)
+                print('      + %-10s %7.2fms  %8d bytes' % (encoding, seconds * 1000, len(compressed)))
+
+
+if __name__ == '__main__':
+    main()
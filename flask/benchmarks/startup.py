@@ -0,0 +1,50 @@
+"""Measure the cold import cost of the application in a fresh interpreter.
+
+Each sample imports ``run`` (as uwsgi does) in a new process, once reading
+the blueprint manifest and once walking the packages. Run it from the flask
+directory with the application's environment set, for example:
+
+    docker-compose exec flask python benchmarks/startup.py
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+PROBE = 'import time; start = time.perf_counter(); import run; print(time.perf_counter() - start)'
+
+
+def sample(manifest):
+    env = dict(os.environ)
+    if manifest is None:
+        env['BLUEPRINT_MANIFEST'] = ''
+    else:
+        env.pop('BLUEPRINT_MANIFEST', None)
+    output = subprocess.check_output([sys.executable, '-c', PROBE], env=env)
+    return float(output.decode('utf-8').split()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    results = {'manifest': [], 'walk': []}
+    # alternate so that both modes see the same disk cache and load
+    for i in range(args.runs):
+        results['manifest'].append(sample(manifest=True))
+        results['walk'].append(sample(manifest=None))
+
+    for name, durations in results.items():
+        durations.sort()
+        print('%s: p50 %.1fms  max %.1fms  mean %.1fms' % (
+            name,
+            statistics.median(durations) * 1000,
+            durations[-1] * 1000,
+            statistics.mean(durations) * 1000,
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -3,13 +3,23 @@ from flasgger import Swagger
 from flask import Flask, jsonify
 from werkzeug.exceptions import HTTPException
 
+from .api.v1.dbs.redis import db as redis
+from .utils.apispec import serve
 from .utils.loading import load_blueprints
 
 application = Flask(__name__)
 swagger = Swagger(application)
 application.config['DEBUG'] = bool(int(os.environ['DEBUG']))
+# where @decorate.cached views store their responses
+application.extensions['cached'] = redis
 
-load_blueprints(application, '.api.v1')
+# BLUEPRINT_MANIFEST= (empty) walks the packages instead of reading the manifest
+manifest = os.environ.get('BLUEPRINT_MANIFEST', os.path.join(os.path.dirname(__file__), 'blueprints.json'))
+load_blueprints(application, '.api.v1', package=__name__, manifest=manifest or None)
+
+# compiled here so that forked workers inherit it - APISPEC_FILE is read instead if it exists
+serve(application, swagger, path=os.environ.get('APISPEC_FILE') or None,
+      max_age=int(os.environ.get('APISPEC_MAX_AGE', 3600)))
 
 
 @application.errorhandler(HTTPException)
@@ -2,4 +2,5 @@ from .auth import auth
 from .group import group
 from .hello import hello
 from .logs import logs
+from .metrics import metrics
 from .user import user
@@ -1,39 +1,107 @@
 import os
+import time
 from datetime import timedelta
 from functools import wraps
 
-from flask import Blueprint, request
-from flask_jwt_extended import JWTManager, get_jti, get_raw_jwt, decode_token
-from werkzeug.security import check_password_hash
+from flask import Blueprint, current_app, request
+from flask_jwt_extended import JWTManager, get_raw_jwt, get_jwt_identity, decode_token
 
-from .utils.msg import Unauthorized, response
-from .utils.creds import authorization, tokenize
-from .dbs.sql import models
+from .utils.msg import Unauthorized, Unavailable, response
+from .utils.creds import (
+    authorization,
+    authorize,
+    tokenize,
+    load_principal,
+    claims_principal,
+    principal_claims,
+)
+from .utils import creds
+from .utils.cache import TTLCache, Invalidator
+from .utils.fork import after_fork
+from .utils.limits import limiter, shedder, parse_limits
+from .utils.paging import check_limit, format_cursor, parse_cursor
+from .utils import registry
+from ...utils import decorate
 from .dbs.redis import db as redis
 
 EXPIRATION = timedelta(minutes=15)
 BUFFERED_EXPIRATION = EXPIRATION * 1.1
+PAGE_SIZE = 1000
 
 jwt = JWTManager()
 auth = Blueprint('auth', __name__, url_prefix='/auth')
 
+# jtis known to be valid - logout evicts them from every worker
+allowed = TTLCache()
+revocations = Invalidator(redis, 'auth.revoked', allowed)
+
 
 @auth.record
 def setup(state):
     state.app.config['JWT_SECRET_KEY'] = os.environ['JWT_SECRET_KEY']
     state.app.config['JWT_BLACKLIST_ENABLED'] = True
     state.app.config['JWT_ACCESS_TOKEN_EXPIRES'] = EXPIRATION
+    allowed.size = int(os.environ.get('AUTH_CACHE_SIZE', 10000))
+    allowed.ttl = float(os.environ.get('AUTH_CACHE_TTL', 30))
+    # embed groups and levels in access tokens so authorization needs no queries
+    state.app.config['AUTH_TOKEN_CLAIMS'] = bool(int(os.environ.get('AUTH_TOKEN_CLAIMS', 0)))
     jwt.init_app(state.app)
+    limiter.configure(parse_limits(os.environ.get('RATE_LIMITS', '')))
+    shedder.configure(
+        threshold=float(os.environ.get('SHED_BUSY_RATIO', 0.9)),
+        exempt=os.environ.get('SHED_EXEMPT', 'metrics.pools').split(),
+    )
+    after_fork(lambda: warm(state.app), order=1)
+
+
+def warm(app, timeout=5):
+    """Fill this worker's caches with the live tokens and group hierarchy."""
+    revocations.start()
+    revocations.subscribed.wait(timeout)
+    low, skip, cursor = time.time(), 0, True
+    while cursor and len(allowed) < allowed.size:
+        version = allowed.version
+        found, cursor = registry.page(low, skip, PAGE_SIZE)
+        now = time.time()
+        for exp, jti, token in found:
+            allowed.set(jti, True, ttl=exp - now, version=version)
+        if cursor:
+            low, skip = cursor
+    with app.app_context():
+        creds.warm(timeout)
+
+
+@auth.before_app_request
+def admit():
+    if shedder.overloaded(request.endpoint):
+        raise Unavailable('The server is overloaded - try again later.', retry_after=1)
+    limiter.check('ip', request.remote_addr, request.endpoint)
+
+
+@jwt.user_claims_loader
+def add_claims(username):
+    if current_app.config['AUTH_TOKEN_CLAIMS']:
+        return principal_claims(username)
+    else:
+        return {}
 
 
 @jwt.user_loader_callback_loader
 def load_user(username):
-    return models.user.User.get(username)
+    return claims_principal(username) or load_principal(username)
 
 
 @jwt.token_in_blacklist_loader
 def is_blacklisted(token):
-    return redis.get('auth.tokens.%s' % token['jti']) is None
+    revocations.start()
+    jti = token['jti']
+    if allowed.get(jti):
+        return False
+    version = allowed.version
+    if redis.get('auth.tokens.%s' % jti) is None:
+        return True
+    allowed.set(jti, True, ttl=token['exp'] - time.time(), version=version)
+    return False
 
 
 @auth.route('/login', methods=['POST'])
@@ -62,8 +130,8 @@ def login():
     username = request.json['username']
     password = request.json['password']
     tokens = tokenize(username, password)
-    key = 'auth.tokens.%s' % get_jti(tokens['access'])
-    redis.set(key, tokens['access'], BUFFERED_EXPIRATION)
+    registry.register(tokens['access'], decode_token(tokens['access']), BUFFERED_EXPIRATION)
+    decorate.invalidate('tokens')
     return response(201, **tokens)
 
 
@@ -82,17 +150,83 @@ def logout():
         required: true
         description: an access token from the user to log out.
     """
-    redis.delete('auth.tokens.%s' % get_raw_jwt()['jti'])
+    jti = get_raw_jwt()['jti']
+    registry.revoke(get_jwt_identity(), jti)
+    allowed.pop(jti)
+    revocations.publish(jti)
+    decorate.invalidate('tokens')
     return response(200, logout=True)
 
 
+@auth.route('/logout/all', methods=['POST'])
+@authorization
+def logout_all():
+    """
+    log a user out of every session
+    ---
+    parameters:
+      - name: body
+        in: body
+        required: false
+        schema:
+          type: object
+          properties:
+            username:
+              type: string
+              description: the user to log out (only the root group may log out others)
+      - name: authorization
+        in: header
+        schema:
+          type: string
+          example: Bearer <JWT>
+        required: true
+        description: an access token from the user to log out or the root user
+    """
+    identity = get_jwt_identity()
+    username = (request.get_json(silent=True) or {}).get('username', identity)
+    if username != identity:
+        authorize((), level=0)
+    jtis = registry.revoke_all(username)
+    for jti in jtis:
+        allowed.pop(jti)
+    revocations.publish(*jtis)
+    decorate.invalidate('tokens')
+    return response(200, logout=True, sessions=len(jtis))
+
+
 @auth.route('/tokens')
 @authorization(level=0)
-def tokens():
+@decorate.cached(ttl=30, tags=('tokens',))
+@decorate.arguments('identity, limit, cursor')
+def tokens(identity=None, limit:int=PAGE_SIZE, cursor=None):
     """
     get all tokens
     ---
+    produces:
+      - application/json
+      - application/x-msgpack
     parameters:
+      - name: identity
+        in: query
+        schema:
+          type: string
+          example: root
+        required: false
+        description: only get the tokens of this user
+      - name: limit
+        in: query
+        schema:
+          type: integer
+          example: 100
+        required: false
+        description: the maximum number of tokens to return (at most 1000)
+      - name: cursor
+        in: query
+        schema:
+          type: string
+          example: 1525767634.0:1
+        required: false
+        description: the cursor returned by a previous request for the next page
       - name: authorization
         in: header
         schema:
@@ -115,6 +249,9 @@ def tokens():
                 data:
                   schema:
                     $ref: '#/definitions/TokenData'
+          cursor:
+            type: string
+            description: pass as "cursor" to get the next page (null if there is none)
       TokenData:
         type: object
         description: the token's decoded data
@@ -150,11 +287,21 @@ def tokens():
         schema:
           $ref: '#/definitions/TokenArray'
     """
+    if identity is not None:
+        found, cursor = registry.sessions(identity), None
+    else:
+        limit = check_limit(limit, PAGE_SIZE)
+        if cursor is None:
+            low, skip = 0, 0
+        else:
+            low, skip = parse_cursor(cursor)
+        found, cursor = registry.page(low, skip, limit)
+        if cursor is not None:
+            cursor = format_cursor(*cursor)
     result = []
-    for key in redis.scan_iter('auth.tokens.*'):
-        token = redis.get(key)
+    for exp, jti, token in found:
         result.append({
             'token': token.decode('utf-8'),
             'data': decode_token(token)
         })
-    return response(200, tokens=result)
+    return response(200, tokens=result, cursor=cursor)
@@ -1,4 +1,162 @@
 import os
-from redis import Redis
+import bisect
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from redis import Redis, BlockingConnectionPool, ConnectionPool, UnixDomainSocketConnection
 
-db = Redis(host=os.environ['REDIS_HOST'], port=int(os.environ['REDIS_PORT']))
+from ..utils.fork import after_fork
+
+# clients by address - their pools are reported by the metrics endpoint
+clients = {}
+
+
+class Client:
+    """A redis client whose connection pool is created in the process that uses it.
+
+    uwsgi imports the application before forking its workers - creating the
+    pool lazily keeps workers from sharing sockets inherited from the master.
+    Once ``max_connections`` are open callers wait up to ``pool_timeout``
+    seconds for one to be released. Subscriptions hold a connection for as
+    long as the worker lives so fewer than that are left for commands.
+    """
+
+    def __init__(self, address, max_connections=None, socket_timeout=None, connect_timeout=None,
+                 pool_timeout=None):
+        self.address = address
+        self.max_connections = max_connections
+        self.pool_timeout = pool_timeout
+        self.socket_timeout = socket_timeout
+        self.connect_timeout = connect_timeout
+        self._redis = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def redis(self):
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    self._redis = Redis(connection_pool=self._pool())
+                    self._pid = pid
+        return self._redis
+
+    def stats(self):
+        stats = {'max': self.max_connections, 'created': 0, 'in_use': 0, 'available': 0}
+        if self._pid == os.getpid():
+            pool = self._redis.connection_pool
+            if isinstance(pool, BlockingConnectionPool):
+                stats['created'] = len(pool._connections)
+                stats['available'] = sum(1 for c in pool.pool.queue if c is not None)
+                stats['in_use'] = stats['created'] - stats['available']
+            else:
+                stats['created'] = pool._created_connections
+                stats['in_use'] = len(pool._in_use_connections)
+                stats['available'] = len(pool._available_connections)
+        return stats
+
+    def connect(self, count):
+        """Open up to ``count`` connections now rather than when requests need them."""
+        pool = self.redis.connection_pool
+        if self.max_connections is not None:
+            count = min(count, self.max_connections)
+        connections = [pool.get_connection('PING') for i in range(count)]
+        try:
+            for connection in connections:
+                connection.connect()
+        finally:
+            for connection in connections:
+                pool.release(connection)
+
+    def __getattr__(self, name):
+        return getattr(self.redis, name)
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, self.address)
+
+    def _pool(self):
+        options = {
+            'socket_timeout': self.socket_timeout,
+            'socket_connect_timeout': self.connect_timeout,
+        }
+        if self.max_connections is None:
+            kind = ConnectionPool
+        else:
+            # wait for a connection rather than failing with "Too many connections"
+            kind = BlockingConnectionPool
+            options.update(max_connections=self.max_connections, timeout=self.pool_timeout)
+        if self.address.startswith('/'):
+            # a co-located redis can be reached through a unix socket
+            return kind(connection_class=UnixDomainSocketConnection, path=self.address, **options)
+        host, port = self.address.rsplit(':', 1)
+        return kind(host=host, port=int(port), **options)
+
+
+def client(address):
+    if address not in clients:
+        clients[address] = Client(
+            address,
+            max_connections=_number(int, 'REDIS_MAX_CONNECTIONS'),
+            socket_timeout=_number(float, 'REDIS_SOCKET_TIMEOUT'),
+            connect_timeout=_number(float, 'REDIS_CONNECT_TIMEOUT'),
+            pool_timeout=_number(float, 'REDIS_POOL_TIMEOUT'),
+        )
+    return clients[address]
+
+
+def _number(kind, name):
+    value = os.environ.get(name)
+    return kind(value) if value else None
+
+
+class ShardedRedis:
+    """Spread keys over several redis nodes with a consistent hash ring."""
+
+    def __init__(self, addresses, replicas=128):
+        self.nodes = []
+        ring = []
+        for address in addresses:
+            node = client(address)
+            self.nodes.append(node)
+            # hash addresses rather than positions so that adding a node
+            # only moves the keys which now belong to it
+            ring.extend((_hash('%s-%s' % (address, i)), node) for i in range(replicas))
+        ring.sort(key=lambda point: point[0])
+        self._hashes = [h for h, node in ring]
+        self._ring = [node for h, node in ring]
+        self._executor = ThreadPoolExecutor(len(self.nodes))
+
+    def node(self, name):
+        index = bisect.bisect(self._hashes, _hash(name)) % len(self._hashes)
+        return self._ring[index]
+
+    def execute(self, pipes):
+        """Execute a mapping of nodes to pipelines concurrently and map nodes to their replies."""
+        if len(pipes) < 2:
+            return {node: pipe.execute() for node, pipe in pipes.items()}
+        futures = {node: self._executor.submit(pipe.execute) for node, pipe in pipes.items()}
+        return {node: future.result() for node, future in futures.items()}
+
+
+def _hash(name):
+    digest = hashlib.md5(name.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big')
+
+
+# REDIS_SOCKET (a unix socket path) takes precedence over REDIS_HOST and REDIS_PORT
+PRIMARY = os.environ.get('REDIS_SOCKET') or '%s:%s' % (os.environ['REDIS_HOST'], os.environ['REDIS_PORT'])
+
+db = client(PRIMARY)
+
+# request logs are spread over these nodes - tokens stay on the primary above
+logs = ShardedRedis(os.environ.get('REDIS_LOG_NODES', PRIMARY).split())
+
+
+def connect():
+    count = _number(int, 'REDIS_WARM_CONNECTIONS')
+    for address, c in clients.items():
+        c.connect(2 if count is None else count)
+
+
+after_fork(connect, order=-1)
@@ -0,0 +1,100 @@
+"""Versioned, forward-only schema migrations.
+
+Each module in this package is named ``v<number>_<description>`` and defines
+an ``upgrade(connection)`` function. Migrations are applied in order of their
+number and recorded in the ``schema_version`` table. They are never
+reverted - undo a change with a new migration instead.
+
+Modules which set ``transactional = False`` run outside of a transaction
+(e.g. for ``CREATE INDEX CONCURRENTLY``). They must be safe to run again in
+case they fail part way.
+
+Models are the source of truth for new databases: ``create_all`` builds the
+current schema. Migrations therefore have to tolerate finding their changes
+already in place.
+"""
+import re
+import logging
+import pkgutil
+import importlib
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# held while migrating so that concurrent deployments don't race
+MIGRATION_LOCK = 0x6d696772
+NAME = re.compile(r'^v(\d+)_\w+$')
+
+
+def available():
+    """Return ``(version, name, module)`` for every migration in order."""
+    found = []
+    for finder, name, ispkg in pkgutil.iter_modules(__path__):
+        match = NAME.match(name)
+        if match:
+            module = importlib.import_module('%s.%s' % (__name__, name))
+            found.append((int(match.group(1)), name, module))
+    found.sort(key=lambda migration: migration[0])
+    versions = [version for version, name, module in found]
+    if len(set(versions)) != len(versions):
+        raise RuntimeError('Migration versions must be unique: %s' % versions)
+    return found
+
+
+def applied(connection):
+    connection.execute(text(
+        'CREATE TABLE IF NOT EXISTS schema_version ('
+        'version INTEGER PRIMARY KEY, '
+        'name VARCHAR(200) NOT NULL, '
+        'applied_at TIMESTAMP NOT NULL DEFAULT now())'
+    ))
+    return {version for version, in connection.execute(text('SELECT version FROM schema_version'))}
+
+
+def upgrade(engine):
+    """Apply every pending migration and return the names of those applied."""
+    migrations = available()
+    done = []
+    with engine.connect() as connection:
+        connection = connection.execution_options(isolation_level='AUTOCOMMIT')
+        connection.execute(text('SELECT pg_advisory_lock(:key)'), key=MIGRATION_LOCK)
+        try:
+            versions = applied(connection)
+            unknown = versions.difference(version for version, name, module in migrations)
+            if unknown:
+                raise RuntimeError('The database has migrations this code does not know: %s' % sorted(unknown))
+            for version, name, module in migrations:
+                if version not in versions:
+                    _apply(engine, connection, version, name, module)
+                    done.append(name)
+        finally:
+            connection.execute(text('SELECT pg_advisory_unlock(:key)'), key=MIGRATION_LOCK)
+    return done
+
+
+def create_index(connection, name, table, *columns):
+    """Build an index without blocking writes - run it from a non-transactional migration."""
+    # an interrupted concurrent build leaves an invalid index behind
+    invalid = connection.execute(text(
+        'SELECT 1 FROM pg_index JOIN pg_class ON pg_class.oid = pg_index.indexrelid '
+        'WHERE pg_class.relname = :name AND NOT pg_index.indisvalid'
+    ), name=name).first()
+    if invalid:
+        connection.execute(text('DROP INDEX CONCURRENTLY %s' % name))
+    connection.execute(text('CREATE INDEX CONCURRENTLY IF NOT EXISTS %s ON %s (%s)' % (
+        name, table, ', '.join(columns),
+    )))
+
+
+def _apply(engine, connection, version, name, module):
+    logger.info('Applying migration %s.', name)
+    record = text('INSERT INTO schema_version (version, name) VALUES (:version, :name)')
+    if getattr(module, 'transactional', True):
+        # the locked connection autocommits - use another for the transaction
+        with engine.begin() as transaction:
+            module.upgrade(transaction)
+            transaction.execute(record, version=version, name=name)
+    else:
+        module.upgrade(connection)
+        connection.execute(record, version=version, name=name)
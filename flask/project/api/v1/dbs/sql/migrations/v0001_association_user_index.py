@@ -0,0 +1,8 @@
+"""Index memberships by user - the primary key leads with the group."""
+from . import create_index
+
+transactional = False
+
+
+def upgrade(connection):
+    create_index(connection, 'ix_association__user', 'association', '_user')
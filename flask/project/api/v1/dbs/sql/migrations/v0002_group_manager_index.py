@@ -0,0 +1,8 @@
+"""Index groups by manager for finding the groups a group manages."""
+from . import create_index
+
+transactional = False
+
+
+def upgrade(connection):
+    create_index(connection, 'ix_group_manager', '"group"', 'manager')
@@ -1,6 +1,18 @@
 import sys
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import orm
 
-db = SQLAlchemy(session_options={"autoflush": False})
+from .routing import RoutingSession, replicas
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    replicas = replicas
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+db = RoutingSQLAlchemy(session_options={"autoflush": False})
 
 sys.modules[__name__] = db
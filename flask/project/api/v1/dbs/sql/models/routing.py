@@ -0,0 +1,105 @@
+import itertools
+import logging
+import os
+import threading
+import time
+
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.sql import Select
+
+logger = logging.getLogger(__name__)
+
+
+class Replicas:
+    """Read replicas chosen in turn from those which passed their last health check."""
+
+    def __init__(self, interval=5, cooldown=30):
+        self.uris = []
+        self.options = {}
+        self.interval = interval
+        self.cooldown = cooldown
+        self.engines = []
+        self._down = {}
+        self._turns = None
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def configure(self, uris, options):
+        self.uris = uris
+        self.options = options
+
+    def choose(self):
+        if not self.uris:
+            return None
+        self._start()
+        now = time.monotonic()
+        for i in range(len(self.engines)):
+            engine = self.engines[next(self._turns)]
+            if self._down.get(engine, 0) <= now:
+                return engine
+        # every replica is down - read from the primary
+        return None
+
+    def healthy(self, engine):
+        return self._down.get(engine, 0) <= time.monotonic()
+
+    def _fail(self, engine):
+        self._down[engine] = time.monotonic() + self.cooldown
+
+    def _start(self):
+        # uwsgi forks workers after import - each one needs its own engines
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    self.engines = [create_engine(uri, **self.options) for uri in self.uris]
+                    for engine in self.engines:
+                        event.listen(engine, 'handle_error', self._handle_error)
+                    self._turns = itertools.cycle(range(len(self.engines)))
+                    self._down = {}
+                    self._pid = pid
+                    thread = threading.Thread(target=self._run, daemon=True)
+                    thread.start()
+
+    def _handle_error(self, context):
+        if context.is_disconnect:
+            self._fail(context.engine)
+
+    def _run(self):
+        while True:
+            for engine in self.engines:
+                try:
+                    with engine.connect() as connection:
+                        connection.execute('SELECT 1')
+                except SQLAlchemyError:
+                    logger.warning('Replica %r failed its health check.', engine.url)
+                    self._fail(engine)
+                else:
+                    self._down.pop(engine, None)
+            time.sleep(self.interval)
+
+
+replicas = Replicas()
+
+
+class RoutingSession(SignallingSession):
+    """Send reads to a replica until the session writes - then stay on the primary."""
+
+    def get_bind(self, mapper=None, clause=None):
+        if self._flushing or (clause is not None and not _is_read(clause)):
+            self.info['written'] = True
+        elif clause is not None and not self.info.get('written'):
+            engine = replicas.choose()
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper, clause)
+
+    def use_primary(self):
+        """Read from the primary for the rest of this session - e.g. when replica lag matters."""
+        self.info['written'] = True
+
+
+def _is_read(clause):
+    return isinstance(clause, Select) and clause._for_update_arg is None
@@ -1,16 +1,23 @@
-from functools import lru_cache
-
 from flask_jwt_extended import get_current_user
-from werkzeug.security import generate_password_hash
+from sqlalchemy import literal
+from sqlalchemy.orm import aliased
 
 from ....utils.msg import Unauthorized
+from ....utils.passwords import hasher
 from . import db
 
 
+def insert(model, rows, size=1000):
+    """Insert mappings of column names to values in multi-row statements."""
+    for i in range(0, len(rows), size):
+        db.session.execute(model.__table__.insert().values(rows[i:i + size]))
+
+
 class Association(db.Model):
 
     _group = db.Column(db.String(50), db.ForeignKey('group.name'), primary_key=True)
-    _user = db.Column(db.String(50), db.ForeignKey('user.username'), primary_key=True)
+    # the primary key leads with _group - lookups by user need their own index
+    _user = db.Column(db.String(50), db.ForeignKey('user.username'), primary_key=True, index=True)
     group = db.relationship("Group", back_populates="users")
     user = db.relationship("User", back_populates="groups")
 
@@ -40,7 +47,7 @@ class User(db.Model):
     groups = db.relationship("Association", back_populates="user")
 
     def __init__(self, *args, **kwargs):
-        password = generate_password_hash(kwargs.pop('password'))
+        password = hasher.hash(kwargs.pop('password'))
         super().__init__(*args, password=password, **kwargs)
 
     @classmethod
@@ -57,7 +64,7 @@ class Group(db.Model):
     name = db.Column(db.String(50), primary_key=True, nullable=False)
     level = db.Column(db.Integer, nullable=False)
     users = db.relationship("Association", back_populates="group")
-    manager = db.Column(db.String(50), db.ForeignKey('group.name'), nullable=True)
+    manager = db.Column(db.String(50), db.ForeignKey('group.name'), nullable=True, index=True)
     manages = db.relationship('Group')
 
     def __init__(self, name, manager, level, **kwargs):
@@ -71,13 +78,42 @@ class Group(db.Model):
         return cls.query.filter_by(name=name).first()
 
     @classmethod
-    @lru_cache(maxsize=32)
-    def management(cls, name):
-        return list(cls.iter_management(name))
+    def chains(cls, names):
+        """Map each named group to a list of it and every group above it.
+
+        The whole hierarchy is resolved with one recursive query.
+        """
+        above = aliased(cls)
+        tree = db.session.query(cls.name.label('origin'), cls.name, cls.manager, literal(0).label('depth'))
+        tree = tree.filter(cls.name.in_(names)).cte('tree', recursive=True)
+        tree = tree.union_all(
+            db.session.query(tree.c.origin, above.name, above.manager, tree.c.depth + 1)
+            .filter(above.name == tree.c.manager)
+        )
+        chains = {}
+        for origin, name, manager, depth in db.session.query(tree).order_by(tree.c.origin, tree.c.depth):
+            chains.setdefault(origin, []).append(name)
+        return chains
+
+
+class Principal:
+    """A user's name and the levels of the groups they belong to."""
+
+    def __init__(self, username, groups):
+        self.username = username
+        self.groups = groups
+
+    @property
+    def level(self):
+        # the lowest level is the most privileged
+        return min(self.groups.values(), default=None)
 
     @classmethod
-    def iter_management(cls, name):
-        manager = cls.get(name=name)
-        if manager is not None:
-            yield manager.name
-            yield from cls.iter_management(manager.manager)
+    def load(cls, username):
+        query = db.session.query(User.username, Group.name, Group.level)
+        query = query.outerjoin(Association, Association._user == User.username)
+        query = query.outerjoin(Group, Group.name == Association._group)
+        rows = query.filter(User.username == username).all()
+        if rows:
+            groups = {name: level for _, name, level in rows if name is not None}
+            return cls(username, groups)
@@ -0,0 +1,72 @@
+import os
+import time
+import threading
+
+from sqlalchemy import event
+from sqlalchemy.exc import DisconnectionError
+from sqlalchemy.pool import QueuePool
+
+
+class Waits:
+    """Time spent by this worker waiting to check connections out of a pool."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+
+    def stats(self):
+        return {
+            'count': self.count,
+            'mean_ms': self.total / self.count * 1000 if self.count else 0,
+            'max_ms': self.max * 1000,
+        }
+
+
+class TimedQueuePool(QueuePool):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # the primary and every replica have pools of their own
+        self.waits = Waits()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            self.waits.observe(time.perf_counter() - start)
+
+
+def stats(engine):
+    pool = engine.pool
+    capacity = pool.size() + max(pool._max_overflow, 0)
+    waits = getattr(pool, 'waits', None) or Waits()
+    return {
+        'size': pool.size(),
+        'max_overflow': pool._max_overflow,
+        'checked_out': pool.checkedout(),
+        'checked_in': pool.checkedin(),
+        'saturation': pool.checkedout() / capacity if capacity else 0,
+        'wait': waits.stats(),
+    }
+
+
+@event.listens_for(TimedQueuePool, 'connect')
+def connect(dbapi_connection, record):
+    record.info['pid'] = os.getpid()
+
+
+@event.listens_for(TimedQueuePool, 'checkout')
+def checkout(dbapi_connection, record, proxy):
+    # never hand out a connection which was opened by another process
+    if record.info['pid'] != os.getpid():
+        record.connection = proxy.connection = None
+        raise DisconnectionError('Connection belongs to process %s.' % record.info['pid'])
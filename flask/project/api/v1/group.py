@@ -1,11 +1,15 @@
 from flask import Blueprint, request, jsonify
+from sqlalchemy.exc import IntegrityError
 
-from .utils.creds import authorization, authorize
-from .utils.msg import Conflict, Absent, response
+from .utils.creds import authorization, authorize, authorize_each, invalidate_principals
+from .utils.msg import Conflict, Absent, response, rows
 from .dbs.sql import models
 
 group = Blueprint('group', __name__, url_prefix='/group')
 
+# the most rows a bulk request may hold
+BULK_SIZE = 1000
+
 
 @group.route('/create', methods=['POST'])
 @authorization
@@ -43,7 +47,7 @@ def create():
     if models.user.Group.get(name):
         raise Conflict('Group already exists.', creation=False)
     else:
-        authorize(manager, level=level)
+        authorize([manager], level=level)
         group = models.user.Group(name=name, level=level, manager=manager)
         models.db.session.add(group)
         models.db.session.commit()
@@ -79,6 +83,105 @@ def delete():
     if not group:
         raise Absent('Group does not exists.', deletion=False)
     else:
+        members = [a._user for a in group.users]
         models.db.session.delete(group)
         models.db.session.commit()
+        invalidate_principals(*members, groups=True)
         return response(200, deletion=True)
+
+
+@group.route('/bulk', methods=['POST'])
+@authorization
+def bulk():
+    """
+    create many user groups at once
+    ---
+    consumes:
+      - application/json
+      - application/x-ndjson
+    parameters:
+      - name: body
+        in: body
+        required: true
+        description: >
+          an array of groups (or one group per line with application/x-ndjson) -
+          groups managed by others in the same request must come after them
+        schema:
+          type: array
+          items:
+            type: object
+            properties:
+              name:
+                type: string
+                description: a name for the group
+              level:
+                type: integer
+                description: the access level of the group (higher number - lower access)
+              manager:
+                type: string
+                description: the name of a group which will manage the new one
+      - name: authorization
+        in: header
+        schema:
+          type: string
+          example: Bearer <JWT>
+        required: true
+        description: an access token from a user who can manage the new groups
+    responses:
+      200:
+        description: the rows which were created and rejected
+        schema:
+          $ref: '#/definitions/BulkResult'
+      400:
+        description: the body is not an array of objects or holds more than 1000 rows
+    """
+    groups = rows(BULK_SIZE)
+    Group = models.user.Group
+    valid = [g for g in groups if _valid(g)]
+    names = [g['name'] for g in valid] + [g.get('manager') for g in valid if g.get('manager')]
+    levels = dict(models.db.session.query(Group.name, Group.level).filter(Group.name.in_(names)))
+    existing = set(levels)
+    refusals = authorize_each(existing.intersection(g.get('manager') for g in valid))
+    user = models.user.User.current()
+
+    accepted, rejected = [], []
+    for i, g in enumerate(groups):
+        name, level, manager = g.get('name'), g.get('level'), g.get('manager')
+        if not _valid(g):
+            msg = 'A name and level are required and the manager must be a group name.'
+        elif name in levels:
+            msg = 'Group already exists.'
+        elif manager is None:
+            msg = 'No user can perform this action.'
+        elif manager not in levels:
+            msg = 'Group %r does not exist.' % manager
+        elif manager in existing and refusals[manager]:
+            msg = refusals[manager].data['msg']
+        elif user.level is None or user.level > level:
+            msg = 'The user %r cannot access level %r.' % (user.username, level)
+        elif not level > levels[manager]:
+            msg = 'The manager %r cannot manage a level %s group.' % (manager, level)
+        else:
+            # groups created earlier in the request may manage later ones
+            levels[name] = level
+            accepted.append({'name': name, 'level': level, 'manager': manager})
+            continue
+        rejected.append({'row': i, 'msg': msg})
+
+    if accepted:
+        try:
+            models.user.insert(Group, accepted)
+            models.db.session.commit()
+        except IntegrityError:
+            models.db.session.rollback()
+            raise Conflict('Groups were created concurrently - none were created.', created=0)
+    return response(200, created=len(accepted), rejected=rejected)
+
+
+def _valid(row):
+    manager = row.get('manager')
+    return bool(
+        isinstance(row.get('name'), str) and row['name']
+        and isinstance(row.get('level'), int) and not isinstance(row['level'], bool)
+        and (manager is None or isinstance(manager, str))
+    )
@@ -2,12 +2,14 @@ from flask import Blueprint
 
 from .utils.creds import authorization
 from .utils.msg import response
+from ...utils import decorate
 
 hello = Blueprint('hello', __name__)
 
 
 @hello.route('/hello-world')
 @authorization
+@decorate.cached(ttl=3600, principal=False)
 def world():
     """
     a hello world message
@@ -26,6 +28,7 @@ def world():
 
 @hello.route('/hello-universe')
 @authorization
+@decorate.cached(ttl=3600, principal=False)
 def universe():
     """
     a hello universe message
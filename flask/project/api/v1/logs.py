@@ -1,30 +1,146 @@
+import os
+import re
+import json
+import time
+import queue
+import uuid
+from datetime import timedelta
+
 import arrow
+import click
 from flask_jwt_extended import jwt_required
-from flask import jsonify, request, Blueprint, current_app
+from flask import g, request, Blueprint, Response, current_app, stream_with_context
 
-from .dbs.redis import db
+from .dbs.redis import db as primary, logs as shards
+from .utils.buffer import LogBuffer, parse_rates
 from .utils.creds import authorization
+from .utils.limits import shedder
+from .utils.msg import Invalid, response
+from .utils.paging import check_limit, format_cursor, parse_cursor
+from .utils import records, stats
+from .utils.slots import Slots
+from .utils.tail import Tail
 from ...utils import decorate
 
 logs = Blueprint('logs', __name__, url_prefix='/logs')
 
+PAGE_SIZE = 1000
+# logs are partitioned into one key per endpoint per hour
+PARTITION = 60 * 60
+# the most partitions read in one round trip
+PARTITIONS_PER_READ = 24
+STATUS_CLASS = re.compile(r'^[1-5]xx$')
+STATUS_CODE = re.compile(r'^[1-5][0-9][0-9]$')
+# seconds between comments sent to keep idle event streams open
+KEEPALIVE = 15
+buffer = LogBuffer(shards)
+feed = Tail(shards, 'logs')
+# open streams across this host's workers
+streams = Slots(2, msg='Too many streams are open - try again later.')
+# a worker holding a stream isn't overloaded
+shedder.exclude(streams)
+
+
+@logs.record
+def setup(state):
+    hours = int(os.environ.get('LOG_RETENTION_HOURS', 7 * 24))
+    state.app.config['LOG_RETENTION'] = timedelta(hours=hours)
+    state.app.config['LOG_INDEX_SIZE'] = int(os.environ.get('LOG_INDEX_SIZE', 100000))
+    streams.configure(int(os.environ.get('LOG_STREAM_LIMIT', 2)))
+    buffer.configure(
+        size=int(os.environ.get('LOG_BUFFER_SIZE', 100)),
+        interval=float(os.environ.get('LOG_FLUSH_INTERVAL', 1)),
+        rates=parse_rates(os.environ.get('LOG_SAMPLE_RATES', '')),
+    )
+
+
+@logs.before_app_request
+def clock():
+    g.request_start = time.perf_counter()
+
 
 @logs.after_app_request
 def save(response):
     now = arrow.utcnow()
-    key = 'logs:%s' % request.endpoint
-    name = '%s %s %s' % (now, request.remote_addr, response.status_code)
-    db.zadd(key, name, now.timestamp)
+    if 'request_start' in g:
+        duration = time.perf_counter() - g.request_start
+    else:
+        duration = None
+    for key, field, ttl in stats.rollups(request.endpoint, now.timestamp, response.status_code, duration):
+        buffer.count(key, field, ttl)
+    if buffer.sampled(request.endpoint):
+        ttl = current_app.config['LOG_RETENTION'] + timedelta(seconds=PARTITION)
+        name = _store(now, request.remote_addr, response.status_code, request.endpoint, ttl)
+        buffer.publish(feed.channel, name)
     return response
 
 
+def _store(at, ip, code, endpoint, ttl):
+    key = _key(endpoint, at.timestamp)
+    name = records.encode(at, ip, code, endpoint)
+    buffer.add(key, name, at.timestamp, ttl)
+    # indexes live on the same shard as the log so they can be intersected
+    cap = current_app.config['LOG_INDEX_SIZE']
+    index = _index_key('status', records.status_class(code), at.timestamp)
+    buffer.add(index, name, at.timestamp, ttl, cap, shard=key)
+    ip = records.normalize_ip(ip)
+    if ip is not None:
+        index = _index_key('ip', ip, at.timestamp)
+        buffer.add(index, name, at.timestamp, ttl, cap, shard=key)
+    return name
+
+
+@logs.cli.command('migrate-legacy')
+def migrate_legacy():
+    """Copy logs out of the unpartitioned logs:<endpoint> keys and make those keys expire.
+
+    Those keys predate partitioning and were written without an expiration.
+    Each one is trimmed to the retention period and expires with its newest
+    log - the copies are what GET /logs/ reads.
+    """
+    retention = current_app.config['LOG_RETENTION']
+    now = arrow.utcnow()
+    oldest = (now - retention).timestamp
+    for node in {primary} | set(shards.nodes):
+        for key in node.scan_iter('logs:*', count=1000):
+            endpoint = key.decode('utf-8')[len('logs:'):]
+            if ':' in endpoint:
+                # an hourly partition
+                continue
+            node.zremrangebyscore(key, '-inf', oldest)
+            copied, newest = 0, None
+            for member, score in node.zscan_iter(key, count=1000):
+                log = records.decode([member])[0]
+                at = arrow.get(score)
+                # expire with the partition it would have been written to
+                ttl = retention + timedelta(seconds=PARTITION) - (now - at)
+                _store(at, log['ip'], log['code'], endpoint, ttl)
+                copied += 1
+                newest = max(newest or score, score)
+                if copied % buffer.size == 0:
+                    # the buffer drops entries when it falls far behind
+                    buffer.flush()
+            buffer.flush()
+            if newest is None:
+                node.delete(key)
+            else:
+                node.expireat(key, int(newest + retention.total_seconds()) + 1)
+            click.echo('Copied %s logs out of %s.' % (copied, key.decode('utf-8')))
+
+
 @logs.route('/')
 @authorization(level=1)
-@decorate.arguments('endpoint, start, stop, humanize')
-def get(endpoint=None, start:arrow.get=None, stop:arrow.get=None, humanize:int=0):
+@decorate.cached(ttl=300, when=lambda: _closed())
+@decorate.arguments('endpoint, start, stop, status, ip, humanize, limit, cursor, stream')
+def get(endpoint=None, start:arrow.get=None, stop:arrow.get=None, status=None, ip=None,
+        humanize:int=0, limit:int=PAGE_SIZE, cursor=None, stream:int=0):
     """
     get logs for application endpoints.
     ---
+    produces:
+      - application/json
+      - application/x-msgpack
+      - application/x-ndjson
     parameters:
       - name: endpoint
         in: query
@@ -47,6 +163,20 @@ def get(endpoint=None, start:arrow.get=None, stop:arrow.get=None, humanize:int=0
           example: 2018-05-08 08:20:34.206335 00:00
         required: false
         description: an ISO formated date
+      - name: status
+        in: query
+        schema:
+            type: string
+            example: 4xx,5xx
+        required: false
+        description: comma separated status code classes to filter by
+      - name: ip
+        in: query
+        schema:
+            type: string
+            example: 172.18.0.1
+        required: false
+        description: a client ip address to filter by
       - name: humanize
         in: query
         schema:
@@ -55,6 +185,28 @@ def get(endpoint=None, start:arrow.get=None, stop:arrow.get=None, humanize:int=0
             example: 1
         required: false
         description: whether or not time should be human readable
+      - name: limit
+        in: query
+        schema:
+            type: integer
+            example: 1000
+        required: false
+        description: the maximum number of logs to return (at most 1000)
+      - name: cursor
+        in: query
+        schema:
+            type: string
+            example: 1525767634.0:1
+        required: false
+        description: the cursor returned by a previous request for the next page
+      - name: stream
+        in: query
+        schema:
+            type: integer
+            enum: [0, 1]
+            example: 1
+        required: false
+        description: stream every log in the window as newline delimited JSON
       - name: authorization
         in: header
         schema:
@@ -63,6 +215,14 @@ def get(endpoint=None, start:arrow.get=None, stop:arrow.get=None, humanize:int=0
         required: true
         description: an access token from a group with level 1 or 0
     definitions:
+      LogPage:
+        type: object
+        properties:
+          logs:
+            $ref: '#/definitions/EndpointMapping'
+          cursor:
+            type: string
+            description: pass as "cursor" to get the next page (null if there is none)
       EndpointMapping:
         type: object
         properties:
@@ -87,32 +247,333 @@ def get(endpoint=None, start:arrow.get=None, stop:arrow.get=None, humanize:int=0
             example: 200
     responses:
       200:
-        description: an array of log objects mapped to a corresopnding endpoint function
+        description: a page of log objects mapped to a corresopnding endpoint function
         schema:
-          $ref: '#/definitions/EndpointMapping'
+          $ref: '#/definitions/LogPage'
     """
-    if stop in (None, 'now'):
+    if stop is None:
         stop = arrow.utcnow()
-    if start is None:
-        start = arrow.get(0)
-    start = start.timestamp
-    stop = stop.timestamp
+    # anything older than the retention period has already expired
+    start = max(start or arrow.get(0), arrow.utcnow() - current_app.config['LOG_RETENTION'])
+    endpoints = [endpoint] if endpoint else list(current_app.view_functions)
+    filters = _filters(status, ip)
+    limit = check_limit(limit, PAGE_SIZE)
+    if cursor is None:
+        low, skip = start.timestamp, 0
+    else:
+        low, skip = parse_cursor(cursor)
+    high = stop.timestamp
+
+    if stream:
+        lines = (json.dumps(r) + '\n' for r in _iter_logs(endpoints, filters, low, high, skip, humanize))
+        return Response(stream_with_context(lines), mimetype='application/x-ndjson')
+
+    page = _read_page(endpoints, filters, low, high, skip, limit + 1)
+    if len(page) > limit:
+        page = page[:limit]
+        cursor = format_cursor(*_advance(page, low, skip))
+    else:
+        cursor = None
 
     logs = {}
-    for e in [endpoint] if endpoint else current_app.view_functions:
-        data = []
-        for result in map(_to_dict, db.zrange('logs:%s' % e, start, stop)):
-            if humanize:
-                result['time'] = arrow.get(result).humanize
-            data.append(result)
-        if data:
-            logs[e] = data
-
-    return jsonify(logs)
-
-
-def _to_dict(x):
-    args = x.decode('utf-8').split(' ', 2)
-    d = dict(zip(('time', 'ip', 'code'), args))
-    d['code'] = int(d['code'])
-    return d
+    for log in _decode(page, humanize):
+        logs.setdefault(log.pop('endpoint'), []).append(log)
+    return response(200, logs=logs, cursor=cursor)
+
+
+@logs.route('/stream')
+@authorization(level=1)
+@decorate.arguments('endpoint, status')
+def stream(endpoint=None, status=None):
+    """
+    follow new logs for application endpoints as server-sent events.
+    ---
+    produces:
+      - text/event-stream
+    parameters:
+      - name: endpoint
+        in: query
+        schema:
+            type: string
+            example: logs.get
+        required: false
+        description: route function
+      - name: status
+        in: query
+        schema:
+            type: string
+            example: 404,5xx
+        required: false
+        description: comma separated status codes or status code classes to filter by
+      - name: authorization
+        in: header
+        schema:
+            type: string
+            example: Bearer YOUR-TOKEN
+        required: true
+        description: an access token from a group with level 1 or 0
+    responses:
+      200:
+        description: a stream of events whose data is a JSON encoded log object with an "endpoint"
+      503:
+        description: too many streams are open - retry after the given number of seconds
+    """
+    codes = set()
+    if status is not None:
+        for code in status.split(','):
+            if not (STATUS_CLASS.match(code) or STATUS_CODE.match(code)):
+                raise Invalid('Unknown status code %r.' % code)
+            codes.add(code)
+
+    def match(log):
+        if endpoint is not None and log['endpoint'] != endpoint:
+            return False
+        code = log['code']
+        return not codes or str(code) in codes or records.status_class(code) in codes
+
+    slot = streams.acquire()
+    try:
+        listener = feed.listen(match)
+    except Exception:
+        streams.release(slot)
+        raise
+
+    def events():
+        while True:
+            try:
+                line = listener.get(timeout=KEEPALIVE)
+            except queue.Empty:
+                yield ': keepalive\n\n'
+            else:
+                yield 'data: %s\n\n' % line
+
+    def close():
+        feed.forget(listener)
+        streams.release(slot)
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    r = Response(events(), mimetype='text/event-stream', headers=headers)
+    # runs even if the client leaves before the first event
+    r.call_on_close(close)
+    return r
+
+
+@logs.route('/stats')
+@authorization(level=1)
+@decorate.arguments('endpoint, start, stop')
+def summary(endpoint=None, start:arrow.get=None, stop:arrow.get=None):
+    """
+    get traffic and latency statistics for application endpoints.
+    ---
+    parameters:
+      - name: endpoint
+        in: query
+        schema:
+            type: string
+            example: logs.get
+        required: false
+        description: route function
+      - name: start
+        in: query
+        schema:
+          type: string
+          example: 2018-05-08 08:20:34.206335 00:00
+        required: false
+        description: an ISO formated date (defaults to one hour ago)
+      - name: stop
+        in: query
+        schema:
+          type: string
+          example: 2018-05-08 08:20:34.206335 00:00
+        required: false
+        description: an ISO formated date
+      - name: authorization
+        in: header
+        schema:
+            type: string
+            example: Bearer YOUR-TOKEN
+        required: true
+        description: an access token from a group with level 1 or 0
+    definitions:
+      EndpointStats:
+        type: object
+        properties:
+          endpoint:
+            $ref: '#/definitions/Stats'
+      Stats:
+        type: object
+        properties:
+          requests:
+            type: integer
+            description: the number of requests in the window
+          throughput:
+            type: number
+            description: requests per second over the window
+          codes:
+            type: object
+            description: the number of responses with each status code
+          latency:
+            type: object
+            description: upper bounds (in milliseconds) of the p50, p95 and p99 latencies
+    responses:
+      200:
+        description: statistics mapped to a corresopnding endpoint function
+        schema:
+          $ref: '#/definitions/EndpointStats'
+    """
+    if stop is None:
+        stop = arrow.utcnow()
+    if start is None:
+        start = stop.shift(hours=-1)
+    endpoints = [endpoint] if endpoint else list(current_app.view_functions)
+    low, high = start.timestamp, stop.timestamp
+
+    pipes, reads = {}, {}
+    for e in endpoints:
+        reads[e] = []
+        for key in stats.keys(e, low, high):
+            node = shards.node(key)
+            pipe = pipes.setdefault(node, node.pipeline(transaction=False))
+            reads[e].append((node, len(pipe)))
+            pipe.hgetall(key)
+    replies = shards.execute(pipes)
+
+    summaries = {}
+    for e in endpoints:
+        rollups = [replies[node][position] for node, position in reads[e]]
+        result = stats.summarize(rollups, high - low)
+        if result['requests']:
+            summaries[e] = result
+    return response(200, **summaries)
+
+
+def _iter_logs(endpoints, filters, low, high, skip, humanize):
+    while True:
+        page = _read_page(endpoints, filters, low, high, skip, PAGE_SIZE)
+        yield from _decode(page, humanize)
+        if len(page) < PAGE_SIZE:
+            break
+        low, skip = _advance(page, low, skip)
+
+
+def _closed():
+    # a window which ended before the buffers last flushed no longer changes
+    stop = request.args.get('stop')
+    if stop is None or request.args.get('stream', '0') != '0' or request.args.get('humanize', '0') != '0':
+        return False
+    try:
+        stop = arrow.get(stop)
+    except (ValueError, RuntimeError):
+        # arrow's parser errors - the view reports the bad argument
+        return False
+    return stop < arrow.utcnow() - timedelta(seconds=buffer.interval * 2)
+
+
+def _filters(status, ip):
+    filters = []
+    if status is not None:
+        classes = status.split(',')
+        for c in classes:
+            if not STATUS_CLASS.match(c):
+                raise Invalid('Unknown status class %r.' % c)
+        filters.append(('status', classes))
+    if ip is not None:
+        address = records.normalize_ip(ip)
+        if address is None:
+            raise Invalid('Invalid ip address %r.' % ip)
+        filters.append(('ip', [address]))
+    return filters
+
+
+def _read_page(endpoints, filters, low, high, skip, count):
+    # members that share the lowest score were partially consumed by the
+    # previous page so fetch enough extra from each key to skip over them
+    results = []
+    partitions = _partitions(low, high)
+    # walk partitions in time order and stop once the page is full - a
+    # batch grows while the partitions before it come up short
+    size = 1
+    while partitions and len(results) < skip + count:
+        batch = partitions[:size]
+        del partitions[:size]
+        size = min(size * 2, PARTITIONS_PER_READ)
+        pipes, reads = {}, []
+        for p in batch:
+            for node, groups, e in _sources(endpoints, filters, p):
+                pipe = pipes.setdefault(node, node.pipeline(transaction=False))
+                key, scratch = _combine(pipe, groups)
+                reads.append((node, len(pipe), e))
+                pipe.zrangebyscore(key, low, high, start=0,
+                                   num=skip + count - len(results), withscores=True)
+                if scratch:
+                    pipe.delete(*scratch)
+        replies = shards.execute(pipes)
+        found = []
+        for node, position, e in reads:
+            found.extend((score, e or '', member) for member, score in replies[node][position])
+        # partitions are disjoint in time so earlier batches sort first
+        found.sort()
+        results.extend(found[:skip + count - len(results)])
+    return results[skip:skip + count]
+
+
+def _sources(endpoints, filters, partition):
+    """Yield ``(node, groups, endpoint)`` - logs are in the intersection of each group's union."""
+    if not filters:
+        for e in endpoints:
+            key = _key(e, partition)
+            yield shards.node(key), [[key]], e
+        return
+    groups = [[_index_key(kind, v, partition) for v in values] for kind, values in filters]
+    if len(endpoints) == 1:
+        key = _key(endpoints[0], partition)
+        yield shards.node(key), groups + [[key]], None
+    else:
+        # every shard indexes the logs it holds
+        for node in shards.nodes:
+            yield node, groups, None
+
+
+def _combine(pipe, groups):
+    scratch = []
+
+    def store(command, keys):
+        key = 'logs-scratch:%s' % uuid.uuid4().hex
+        command(key, keys, aggregate='MIN')
+        # in case the pipeline is interrupted before the key is deleted
+        pipe.expire(key, 60)
+        scratch.append(key)
+        return key
+
+    keys = [g[0] if len(g) == 1 else store(pipe.zunionstore, g) for g in groups]
+    key = keys[0] if len(keys) == 1 else store(pipe.zinterstore, keys)
+    return key, scratch
+
+
+def _partitions(low, high):
+    first = int(low) // PARTITION * PARTITION
+    return list(range(first, int(high) + 1, PARTITION))
+
+
+def _key(endpoint, timestamp):
+    return 'logs:%s:%s' % (endpoint, int(timestamp) // PARTITION * PARTITION)
+
+
+def _index_key(kind, value, timestamp):
+    return 'logs-index:%s:%s:%s' % (kind, value, int(timestamp) // PARTITION * PARTITION)
+
+
+def _advance(page, low, skip):
+    last = page[-1][0]
+    seen = sum(1 for score, e, member in page if score == last)
+    return last, (seen + skip if last == low else seen)
+
+
+def _decode(page, humanize=False):
+    logs = records.decode([member for score, e, member in page])
+    for (score, e, member), log in zip(page, logs):
+        # older records don't know their endpoint - take it from their key
+        log['endpoint'] = log['endpoint'] or e or None
+        if humanize:
+            log['time'] = arrow.get(log['time']).humanize()
+    return logs
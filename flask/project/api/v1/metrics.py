@@ -0,0 +1,90 @@
+from flask import Blueprint
+
+from .utils.creds import authorization
+from .utils.msg import response
+from .dbs import redis
+from .dbs.sql import models, pool
+
+metrics = Blueprint('metrics', __name__, url_prefix='/metrics')
+
+
+@metrics.route('/pools')
+@authorization(level=1)
+def pools():
+    """
+    get connection pool usage for this worker
+    ---
+    parameters:
+      - name: authorization
+        in: header
+        schema:
+            type: string
+            example: Bearer YOUR-TOKEN
+        required: true
+        description: an access token from a group with level 1 or 0
+    definitions:
+      RedisPool:
+        type: object
+        properties:
+          max:
+            type: integer
+            description: the most connections the pool may open (null if unbounded)
+          created:
+            type: integer
+            description: connections opened by the pool
+          in_use:
+            type: integer
+            description: connections currently checked out
+          available:
+            type: integer
+            description: idle connections
+      SqlPool:
+        type: object
+        properties:
+          size:
+            type: integer
+            description: connections kept open by the pool
+          max_overflow:
+            type: integer
+            description: connections which may be opened beyond the pool size
+          checked_out:
+            type: integer
+            description: connections currently checked out
+          checked_in:
+            type: integer
+            description: idle connections
+          saturation:
+            type: number
+            description: the fraction of all allowed connections which are checked out
+          wait:
+            type: object
+            description: the count, mean and max time (in milliseconds) spent waiting for a connection
+          healthy:
+            type: boolean
+            description: whether a replica passed its last health check (replicas only)
+    responses:
+      200:
+        description: redis pools mapped to their address
+        schema:
+          type: object
+          properties:
+            redis:
+              type: object
+              additionalProperties:
+                $ref: '#/definitions/RedisPool'
+            sql:
+              $ref: '#/definitions/SqlPool'
+            replicas:
+              type: array
+              items:
+                $ref: '#/definitions/SqlPool'
+    """
+    return response(
+        200,
+        redis={a: c.stats() for a, c in redis.clients.items()},
+        sql=pool.stats(models.db.engine),
+        replicas=[
+            dict(pool.stats(engine), healthy=models.db.replicas.healthy(engine))
+            for engine in models.db.replicas.engines
+        ],
+    )
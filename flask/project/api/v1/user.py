@@ -1,11 +1,16 @@
 from flask import Blueprint, request, jsonify
+from sqlalchemy.exc import IntegrityError
 
-from .utils.creds import authorization, authorize
-from .utils.msg import Conflict, Absent, response
+from .utils.creds import authorization, authorize, authorize_each, invalidate_principals
+from .utils.msg import Conflict, Absent, response, rows
+from .utils.passwords import hasher
 from .dbs.sql import models
 
 user = Blueprint('user', __name__, url_prefix='/user')
 
+# the most rows a bulk request may hold
+BULK_SIZE = 1000
+
 
 @user.route('/create', methods=['POST'])
 @authorization
@@ -43,13 +48,16 @@ def create():
     username = request.json['username']
     password = request.json['password']
 
-    if User.get(username):
+    if models.user.User.get(username):
         raise Conflict('User already exists.', creation=False)
     else:
         authorize(groups, managers=True)
-        user = User(username=username, password=password)
-        models.db.session.add_all(Association(user=user, group=Group.get(g)) for g in groups)
+        user = models.user.User(username=username, password=password)
+        models.db.session.add_all(
+            models.user.Association(user=user, group=models.user.Group.get(g)) for g in groups
+        )
         models.db.session.commit()
+        invalidate_principals(username)
         return response(200, creation=True)
 
 
@@ -79,12 +87,127 @@ def delete():
     """
     username = request.json['username']
 
-    user = User.get(username)
+    user = models.user.User.get(username)
     if not user:
         raise Absent('User does not exists.', deletion=False)
-    elif User.current().username != username:
+    elif models.user.User.current().username != username:
         # authorize user deletion by a manager of that user's group
         authorize([a.group.name for a in user.groups], managers=True)
     models.db.session.delete(user)
     models.db.session.commit()
+    invalidate_principals(username)
     return response(200, deletion=True)
+
+
+@user.route('/bulk', methods=['POST'])
+@authorization
+def bulk():
+    """
+    create many users at once
+    ---
+    consumes:
+      - application/json
+      - application/x-ndjson
+    parameters:
+      - name: body
+        in: body
+        required: true
+        description: an array of users (or one user per line with application/x-ndjson)
+        schema:
+          type: array
+          items:
+            type: object
+            properties:
+              username:
+                type: string
+                description: a name for the user
+              password:
+                type: string
+                description: a password for the user
+              groups:
+                type: array
+                items:
+                  type: string
+                description: assigns the user to these groups
+      - name: authorization
+        in: header
+        schema:
+          type: string
+          example: Bearer <JWT>
+        required: true
+        description: an access token from a user who can manage the new users
+    definitions:
+      BulkResult:
+        type: object
+        properties:
+          created:
+            type: integer
+            description: the number of rows which were created
+          rejected:
+            type: array
+            items:
+              type: object
+              properties:
+                row:
+                  type: integer
+                  description: the index of the rejected row
+                msg:
+                  type: string
+                  description: why the row was rejected
+    responses:
+      200:
+        description: the rows which were created and rejected
+        schema:
+          $ref: '#/definitions/BulkResult'
+      400:
+        description: the body is not an array of objects or holds more than 1000 rows
+    """
+    users = rows(BULK_SIZE)
+    User = models.user.User
+    valid = [u for u in users if _valid(u)]
+    names = [u['username'] for u in valid]
+    existing = {n for n, in models.db.session.query(User.username).filter(User.username.in_(names))}
+    # a user may be added to groups that any of its groups' managers can manage
+    refusals = authorize_each({g for u in valid for g in u.get('groups', ())}, managers=True)
+
+    accepted, rejected = [], []
+    for i, u in enumerate(users):
+        if not _valid(u):
+            rejected.append({'row': i, 'msg': 'A username, password and list of group names are required.'})
+            continue
+        # repeating a group would insert its membership twice
+        groups = list(dict.fromkeys(u.get('groups', [])))
+        missing = [g for g in groups if isinstance(refusals[g], Absent)]
+        if u['username'] in existing:
+            rejected.append({'row': i, 'msg': 'User already exists.'})
+        elif missing:
+            rejected.append({'row': i, 'msg': refusals[missing[0]].data['msg']})
+        elif groups and all(refusals[g] for g in groups):
+            rejected.append({'row': i, 'msg': refusals[groups[0]].data['msg']})
+        else:
+            existing.add(u['username'])
+            accepted.append(dict(u, groups=groups))
+
+    if accepted:
+        passwords = hasher.hash_all([u['password'] for u in accepted])
+        try:
+            models.user.insert(User, [
+                {'username': u['username'], 'password': p} for u, p in zip(accepted, passwords)
+            ])
+            models.user.insert(models.user.Association, [
+                {'_user': u['username'], '_group': g} for u in accepted for g in u['groups']
+            ])
+            models.db.session.commit()
+        except IntegrityError:
+            models.db.session.rollback()
+            raise Conflict('Users were created concurrently - none were created.', created=0)
+    return response(200, created=len(accepted), rejected=rejected)
+
+
+def _valid(row):
+    groups = row.get('groups', [])
+    return bool(
+        isinstance(row.get('username'), str) and row['username']
+        and isinstance(row.get('password'), str) and row['password']
+        and isinstance(groups, list) and all(isinstance(g, str) for g in groups)
+    )
@@ -0,0 +1,127 @@
+import atexit
+import logging
+import os
+import random
+import threading
+from collections import Counter
+
+from redis import RedisError
+
+logger = logging.getLogger(__name__)
+
+
+class LogBuffer:
+    """Queue log entries in memory and write them to redis shards in batches."""
+
+    def __init__(self, db, size=100, interval=1.0, rates=None):
+        self.db = db
+        self.size = size
+        self.interval = interval
+        self.rates = rates or {}
+        self._entries = []
+        self._counts = Counter()
+        self._ttls = {}
+        self._caps = {}
+        self._messages = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pid = None
+
+    def configure(self, size=None, interval=None, rates=None):
+        if size is not None:
+            self.size = size
+        if interval is not None:
+            self.interval = interval
+        if rates is not None:
+            self.rates = rates
+
+    def sampled(self, endpoint):
+        rate = self.rates.get(endpoint, 1.0)
+        return rate >= 1 or random.random() < rate
+
+    def add(self, key, member, score, ttl=None, cap=None, shard=None):
+        node = self.db.node(shard or key)
+        self._start()
+        with self._lock:
+            self._entries.append((node, key, member, score))
+            if ttl is not None:
+                self._ttls[node, key] = ttl
+            if cap is not None:
+                self._caps[node, key] = cap
+            if len(self._entries) > self.size * 10:
+                # redis is unreachable - drop the oldest entries
+                del self._entries[:-self.size * 10]
+            full = len(self._entries) >= self.size
+        if full:
+            self._wake.set()
+
+    def publish(self, channel, message):
+        node = self.db.node(channel)
+        self._start()
+        with self._lock:
+            self._messages.append((node, channel, message))
+            del self._messages[:-self.size * 10]
+
+    def count(self, key, field, ttl, shard=None):
+        node = self.db.node(shard or key)
+        self._start()
+        with self._lock:
+            self._counts[node, key, field] += 1
+            self._ttls[node, key] = ttl
+
+    def flush(self):
+        with self._lock:
+            entries, self._entries = self._entries, []
+            counts, self._counts = self._counts, Counter()
+            ttls, self._ttls = self._ttls, {}
+            caps, self._caps = self._caps, {}
+            messages, self._messages = self._messages, []
+        pipes = {}
+
+        def pipeline(node):
+            if node not in pipes:
+                pipes[node] = node.pipeline(transaction=False)
+            return pipes[node]
+
+        for node, key, member, score in entries:
+            pipeline(node).zadd(key, member, score)
+        for (node, key), cap in caps.items():
+            # keep only the most recent members
+            pipeline(node).zremrangebyrank(key, 0, -cap - 1)
+        for (node, key, field), amount in counts.items():
+            pipeline(node).hincrby(key, field, amount)
+        for (node, key), ttl in ttls.items():
+            pipeline(node).expire(key, ttl)
+        for node, channel, message in messages:
+            pipeline(node).publish(channel, message)
+        for node, pipe in pipes.items():
+            try:
+                pipe.execute()
+            except RedisError:
+                # one unreachable shard shouldn't lose the others' entries
+                logger.exception('Failed to flush buffered log entries to %r.', node)
+
+    def _start(self):
+        # uwsgi forks workers after import - each one needs its own thread
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    self._pid = pid
+                    thread = threading.Thread(target=self._run, daemon=True)
+                    thread.start()
+                    atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+
+def parse_rates(text):
+    rates = {}
+    for item in text.split():
+        endpoint, rate = item.split('=', 1)
+        rates[endpoint] = float(rate)
+    return rates
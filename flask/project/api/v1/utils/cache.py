@@ -0,0 +1,112 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from redis import RedisError
+
+logger = logging.getLogger(__name__)
+
+
+class TTLCache:
+    """A size bounded, least recently used mapping whose entries expire."""
+
+    def __init__(self, size=10000, ttl=30):
+        self.size = size
+        self.ttl = ttl
+        self.version = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                value, expires = self._data[key]
+                if expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    return value
+                del self._data[key]
+        return default
+
+    def set(self, key, value, ttl=None, version=None):
+        """Store a value for at most ``ttl`` seconds.
+
+        If a ``version`` is given the value is only stored if nothing has
+        been evicted since it was read - otherwise it may already be stale.
+        """
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        with self._lock:
+            if version is not None and version != self.version:
+                return
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self.version += 1
+            return self._data.pop(key, (None, None))[0]
+
+    def clear(self):
+        with self._lock:
+            self.version += 1
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class Invalidator:
+    """Evict entries from local caches when keys are published to a redis channel.
+
+    Publishing ``*`` clears the caches entirely.
+    """
+
+    def __init__(self, db, channel, *caches):
+        self.db = db
+        self.channel = channel
+        self.caches = caches
+        self.subscribed = threading.Event()
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def publish(self, *keys):
+        pipe = self.db.pipeline(transaction=False)
+        for key in keys:
+            pipe.publish(self.channel, key)
+        pipe.execute()
+
+    def start(self):
+        # uwsgi forks workers after import - each one needs its own subscription
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    self._pid = pid
+                    self.subscribed = threading.Event()
+                    thread = threading.Thread(target=self._run, daemon=True)
+                    thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                pubsub = self.db.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                # evictions may have been missed while we weren't subscribed
+                for cache in self.caches:
+                    cache.clear()
+                self.subscribed.set()
+                for message in pubsub.listen():
+                    if message['type'] == 'message':
+                        key = message['data'].decode('utf-8')
+                        for cache in self.caches:
+                            if key == '*':
+                                cache.clear()
+                            else:
+                                cache.pop(key)
+            except RedisError:
+                self.subscribed.clear()
+                logger.exception('Lost subscription to %r.', self.channel)
+                time.sleep(1)
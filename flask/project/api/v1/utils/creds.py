@@ -1,23 +1,104 @@
 import os
 from functools import wraps
 
+from flask import request
 from flask_jwt_extended import (
     jwt_required,
     fresh_jwt_required,
     jwt_refresh_token_required,
     create_access_token,
     create_refresh_token,
+    get_jwt_claims,
+    get_jwt_identity,
 )
-from werkzeug.security import check_password_hash
 
-from .msg import Unauthorized
+from .msg import Absent, Status, Unauthorized
+from .cache import TTLCache, Invalidator
+from .limits import limiter
+from .passwords import hasher
 from ..dbs.sql import models
+from ..dbs.redis import db as redis
+
+# principals are cached briefly and evicted from every worker when memberships change
+principals = TTLCache(ttl=5)
+# management chains of groups - cleared when groups are created or deleted
+hierarchy = TTLCache(ttl=300)
+memberships = Invalidator(redis, 'auth.memberships', principals, hierarchy)
 
 
 def validate_credentials(username, password):
     user = models.user.User.get(username)
-    if user is None or not check_password_hash(user.password, password):
+    if user is None or not hasher.verify(user.password, password):
         raise Unauthorized('Invalid username or password.')
+    if hasher.outdated(user.password):
+        # the hash parameters have changed since this password was stored
+        user.password = hasher.hash(password)
+        models.db.session.commit()
+
+
+def load_principal(username):
+    memberships.start()
+    principal = principals.get(username)
+    if principal is None:
+        version = principals.version
+        principal = models.user.Principal.load(username)
+        if principal is not None:
+            principals.set(username, principal, version=version)
+    return principal
+
+
+def invalidate_principals(*usernames, groups=False):
+    """Evict the principals of users whose memberships changed and outdate their tokens' claims.
+
+    With ``groups`` every worker also forgets the management chains of every
+    group - for when a group is deleted.
+    """
+    pipe = redis.pipeline(transaction=False)
+    for username in usernames:
+        principals.pop(username)
+        pipe.incr('auth.memberships.%s' % username)
+    pipe.execute()
+    if groups:
+        principals.clear()
+        hierarchy.clear()
+        memberships.publish('*')
+    else:
+        memberships.publish(*usernames)
+
+
+def membership_version(username):
+    return int(redis.get('auth.memberships.%s' % username) or 0)
+
+
+def claims_principal(username):
+    """The principal described by the current token's claims - if they're still current."""
+    claims = get_jwt_claims()
+    if 'groups' not in claims or claims['version'] != membership_version(username):
+        # memberships changed since the token was issued - the caller loads them instead
+        return None
+    return models.user.Principal(username, claims['groups'])
+
+
+def principal_claims(username):
+    # read the version first - a change made after it outdates these claims
+    version = membership_version(username)
+    # neither the cache nor a lagging replica may be older than the version
+    models.db.session().use_primary()
+    principal = models.user.Principal.load(username)
+    return {
+        'groups': principal.groups,
+        'level': principal.level,
+        'version': version,
+    }
+
+
+def warm(timeout=5):
+    """Subscribe to membership changes and cache the management chain of every group."""
+    memberships.start()
+    # caches are cleared once subscribed - anything cached before that is lost
+    memberships.subscribed.wait(timeout)
+    query = models.db.session.query(models.user.Group.name).limit(hierarchy.size)
+    _chains([name for name, in query])
 
 
 def tokenize(username, password, fresh=False, refresh=False):
@@ -34,6 +115,8 @@ def authorization(groups=(), level=None, managers=False):
         @wraps(function)
         def wrapper(*args, **kwargs):
             authorize(groups, level=level, managers=managers)
+            # the address was limited before the request - now that it's known, so is the user
+            limiter.check('identity', get_jwt_identity(), request.endpoint)
             return function(*args, **kwargs)
         return wrapper
     if callable(groups):
@@ -43,6 +126,19 @@ def authorization(groups=(), level=None, managers=False):
         return setup
 
 
+def authorize_each(groups, managers=False):
+    """Authorize the current user for each group alone - mapping groups to the refusal, if any."""
+    refusals = {}
+    for g in groups:
+        try:
+            _authorize([g], managers=managers)
+        except Status as refusal:
+            refusals[g] = refusal
+        else:
+            refusals[g] = None
+    return refusals
+
+
 def authorize(groups, level=None, managers=False, kind='access', fresh=False):
     if kind == 'access':
         if fresh:
@@ -60,26 +156,23 @@ def authorize(groups, level=None, managers=False, kind='access', fresh=False):
 
 def _authorize(groups, level=None, managers=False):
     if managers:
-        groups = [models.user.Group.get(g).manager for g in groups]
-        groups = list(filter(lambda g : g is not None, groups))
+        chains = _chains(groups)
+        for g in groups:
+            if chains[g] is None:
+                raise Absent('Group %r does not exist.' % g)
+        groups = [chains[g][1] for g in groups if len(chains[g]) > 1]
     if None in groups:
         raise Unauthorized('No user can perform this action.')
     user = models.user.User.current()
     if level is not None:
-        for relationship in user.groups:
-            if relationship.group.level <= level:
-                break
-        else:
+        if user.level is None or user.level > level:
             form = 'The user %r cannot access level %r.'
             raise Unauthorized(form % (user.username, level))
     if groups:
         groups = list(_management(groups))
-        for relationship in user.groups:
-            if relationship.group.name in groups:
-                break
-        else:
+        if not any(g in user.groups for g in groups):
             allowed = ', '.join(map(repr, groups))
-            dissallowed = ', '.join(r.group.name for r in user.groups)
+            dissallowed = ', '.join(user.groups)
             form = 'Only %r grouped users are allowed - %r is in %r.'
             fill = (allowed, user.username, dissallowed)
             raise Unauthorized(form % fill)
@@ -87,9 +180,23 @@ def _authorize(groups, level=None, managers=False):
 
 
 def _management(groups):
+    chains = _chains(groups)
     for g in groups:
         yield g
-        yield from models.user.Group.management(g)
+        yield from chains[g] or ()
+
+
+def _chains(groups):
+    chains = {g: hierarchy.get(g) for g in groups}
+    missing = [g for g, chain in chains.items() if chain is None]
+    if missing:
+        version = hierarchy.version
+        for name, chain in models.user.Group.chains(missing).items():
+            chains[name] = chain
+            # every group above this one has a chain which is a suffix of it
+            for i, above in enumerate(chain):
+                hierarchy.set(above, chain[i:], version=version)
+    return chains
 
 
 _stale_authorize = jwt_required(_authorize)
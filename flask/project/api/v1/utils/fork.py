@@ -0,0 +1,33 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# run in every uwsgi worker right after it forks - lower orders run first
+hooks = []
+
+
+def after_fork(function, order=0):
+    """Run ``function`` in each worker once it has forked from the uwsgi master.
+
+    Without uwsgi (e.g. the development server) nothing is run and the
+    connections and caches these functions warm up are created on first use.
+    """
+    if not hooks:
+        try:
+            from uwsgidecorators import postfork
+        except ImportError:
+            pass
+        else:
+            postfork(run)
+    hooks.append((order, function))
+    hooks.sort(key=lambda hook: hook[0])
+    return function
+
+
+def run():
+    for order, function in hooks:
+        try:
+            function()
+        except Exception:
+            # a cold worker is still better than none
+            logger.exception('Warming up with %r failed.', function)
@@ -0,0 +1,140 @@
+import logging
+import time
+
+from redis import RedisError
+
+from .msg import Limited
+from ..dbs.redis import db as redis
+
+try:
+    import uwsgi
+except ImportError:
+    uwsgi = None
+
+logger = logging.getLogger(__name__)
+
+# Refill every bucket named by KEYS and take a token from each - or from none
+# if any is empty. ARGV holds the current time followed by the rate and burst
+# of each bucket. Returns the seconds until every bucket has a token again.
+TOKEN_BUCKETS = """
+local now = tonumber(ARGV[1])
+local levels = {}
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2])
+    local burst = tonumber(ARGV[i * 2 + 1])
+    local bucket = redis.call('HMGET', key, 'tokens', 'time')
+    local tokens = tonumber(bucket[1]) or burst
+    local last = tonumber(bucket[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - last) * rate)
+    if tokens < 1 then
+        wait = math.max(wait, (1 - tokens) / rate)
+    end
+    levels[i] = tokens
+end
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2])
+    local burst = tonumber(ARGV[i * 2 + 1])
+    local tokens = levels[i]
+    if wait == 0 then
+        tokens = tokens - 1
+    end
+    redis.call('HMSET', key, 'tokens', tokens, 'time', now)
+    redis.call('EXPIRE', key, math.ceil(burst / rate) + 1)
+end
+return tostring(wait)
+"""
+
+
+class Limiter:
+    """Token buckets per client (an ip address or identity) and per client of an endpoint.
+
+    ``rules`` map ``ip``, ``identity`` and endpoint names to a ``(rate,
+    burst)`` pair - the tokens added per second and the most a bucket holds.
+    """
+
+    def __init__(self, db, rules=None):
+        self.db = db
+        self.rules = rules or {}
+        self._script = None
+
+    def configure(self, rules=None):
+        if rules is not None:
+            self.rules = rules
+
+    def check(self, kind, client, endpoint=None, now=None):
+        """Take a token from each of the client's buckets or raise :class:`Limited`."""
+        buckets = []
+        if kind in self.rules:
+            buckets.append(('limits.%s.%s' % (kind, client), self.rules[kind]))
+        if endpoint in self.rules:
+            buckets.append(('limits.%s.%s.%s' % (endpoint, kind, client), self.rules[endpoint]))
+        if not buckets or client is None:
+            return
+        if self._script is None:
+            self._script = self.db.register_script(TOKEN_BUCKETS)
+        args = [time.time() if now is None else now]
+        for key, (rate, burst) in buckets:
+            args.extend((rate, burst))
+        try:
+            wait = float(self._script(keys=[key for key, rule in buckets], args=args, client=self.db.redis))
+        except RedisError:
+            # limits protect the service - they shouldn't take it down with redis
+            logger.exception('Could not check rate limits.')
+            return
+        if wait > 0:
+            raise Limited('Too many requests - try again later.', retry_after=wait)
+
+
+class Shedder:
+    """Refuse requests while most uwsgi workers are busy so the rest finish in time."""
+
+    def __init__(self, threshold=0.9, exempt=()):
+        self.threshold = threshold
+        self.exempt = set(exempt)
+        self.parked = []
+
+    def exclude(self, slots):
+        """Leave workers holding one of these slots (e.g. an open stream) out of the busy ratio."""
+        self.parked.append(slots)
+
+    def configure(self, threshold=None, exempt=None):
+        if threshold is not None:
+            self.threshold = threshold
+        if exempt is not None:
+            self.exempt = set(exempt)
+
+    def overloaded(self, endpoint):
+        if endpoint in self.exempt or self.threshold >= 1 or uwsgi is None:
+            return False
+        return busy(sum(slots.held for slots in self.parked)) > self.threshold
+
+
+def busy(parked=0):
+    """The fraction of uwsgi workers handling a request - this one included.
+
+    Workers idled by uwsgi's cheaper mode count as free since they can be
+    spawned again. ``parked`` workers (which are busy for as long as a
+    client stays connected) are left out altogether.
+    """
+    if uwsgi is None:
+        return 0.0
+    workers = uwsgi.workers()
+    total = len(workers) - parked
+    if total <= 0:
+        return 1.0
+    return (sum(1 for w in workers if w['status'] == 'busy') - parked) / total
+
+
+limiter = Limiter(redis)
+shedder = Shedder()
+
+
+def parse_limits(text):
+    """Parse ``name=rate/burst`` items such as ``ip=20/40 auth.login=1/5``."""
+    rules = {}
+    for item in text.split():
+        name, rule = item.split('=', 1)
+        rate, burst = rule.split('/', 1)
+        rules[name] = (float(rate), float(burst))
+    return rules
@@ -1,17 +1,41 @@
 import json
-from flask import jsonify
+import math
+from flask import request
 from werkzeug.exceptions import HTTPException
 
+from .serial import serializer
+
 
 def response(http_status_code, **data):
-    r = jsonify(data)
-    r.status_code = http_status_code
-    return r
+    return serializer.response(http_status_code, data)
+
+
+def rows(maximum):
+    """Read the request body as a JSON array or as newline delimited JSON of at most ``maximum`` objects."""
+    if request.mimetype == 'application/x-ndjson':
+        body = []
+        for i, line in enumerate(request.stream):
+            if not line.strip():
+                continue
+            try:
+                body.append(json.loads(line))
+            except ValueError:
+                raise Invalid('Line %s is not valid JSON.' % (i + 1))
+    else:
+        body = request.get_json(silent=True)
+    if not isinstance(body, list) or not all(isinstance(row, dict) for row in body):
+        raise Invalid('The body must be an array of objects.')
+    if len(body) > maximum:
+        raise Invalid('At most %s rows can be sent at once.' % maximum)
+    return body
 
 
 class Status(HTTPException):
     """Create an http status code"""
 
+    # seconds the client should wait before trying again - if known
+    retry_after = None
+
     def __init_subclass__(cls, code=None):
         if code is not None:
             cls.code = code
@@ -19,11 +43,13 @@ class Status(HTTPException):
     def __init__(self, msg, **data):
         data['msg'] = msg
         self.data = data
+        self.retry_after = data.get('retry_after', self.retry_after)
         super().__init__(msg)
 
     def json(self):
-        response = jsonify(self.data)
-        response.status_code = self.code
+        response = serializer.response(self.code, self.data)
+        if self.retry_after is not None:
+            response.headers['Retry-After'] = str(int(math.ceil(self.retry_after)))
         return response
 
 
@@ -31,9 +57,21 @@ class Absent(Status, code=400):
     """No result exists."""
 
 
+class Invalid(Status, code=400):
+    """The request's arguments are malformed."""
+
+
 class Conflict(Status, code=409):
     """A result with the given specification already exists."""
 
 
 class Unauthorized(Status, code=401):
     """User does not have access to an endpoint or function."""
+
+
+class Limited(Status, code=429):
+    """The client has made too many requests."""
+
+
+class Unavailable(Status, code=503):
+    """The server is too busy to handle the request."""
@@ -0,0 +1,25 @@
+import math
+
+from .msg import Invalid
+
+
+def check_limit(limit, maximum):
+    if not 1 <= limit <= maximum:
+        raise Invalid('The limit must be between 1 and %s - not %r.' % (maximum, limit))
+    return limit
+
+
+def parse_cursor(cursor):
+    """Parse a ``score:skip`` cursor returned with a previous page."""
+    try:
+        score, skip = cursor.rsplit(':', 1)
+        score, skip = float(score), int(skip)
+    except ValueError:
+        raise Invalid('Malformed cursor %r.' % cursor)
+    if skip < 0 or not math.isfinite(score):
+        raise Invalid('Malformed cursor %r.' % cursor)
+    return score, skip
+
+
+def format_cursor(score, skip):
+    return '%r:%s' % (score, skip)
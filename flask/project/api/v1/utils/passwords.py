@@ -0,0 +1,93 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from itertools import repeat
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from .slots import Slots
+
+
+class Hasher:
+    """Hash and verify passwords while bounding how many run at once on this host.
+
+    Key derivation is deliberately slow - without a limit a burst of logins
+    would occupy every CPU the other endpoints need. At most ``workers``
+    hashes run at once across the host's uwsgi workers and up to ``depth``
+    more wait for one to finish. Calls beyond that fail fast with a 503, as
+    do those which waited ``timeout`` seconds.
+    """
+
+    def __init__(self, method='pbkdf2:sha256:50000', workers=2, depth=16, timeout=30):
+        self.method = method
+        self.timeout = timeout
+        self._prefix = None
+        self.configure(workers, depth)
+
+    def configure(self, workers, depth):
+        # shared memory - this must happen before uwsgi forks its workers
+        self.workers = workers
+        self.depth = depth
+        msg = 'Too many passwords are being checked - try again later.'
+        self._running = Slots(max(workers, 1), retry_after=1, msg=msg)
+        self._queued = Slots(max(workers, 1) + depth, retry_after=1, msg=msg)
+
+    def hash(self, password):
+        with self._slot():
+            return generate_password_hash(password, self.method)
+
+    def hash_all(self, passwords):
+        """Hash many passwords in parallel on the running slots which are free.
+
+        One slot is left for logins unless it's the only one.
+        """
+        with self._slot():
+            extra = []
+            while len(extra) < min(self.workers - 2, len(passwords) - 1):
+                slot = self._running.take()
+                if slot is None:
+                    break
+                extra.append(slot)
+            try:
+                if not extra:
+                    return [generate_password_hash(password, self.method) for password in passwords]
+                with ProcessPoolExecutor(len(extra) + 1) as pool:
+                    chunksize = max(1, len(passwords) // (4 * (len(extra) + 1)))
+                    return list(pool.map(
+                        generate_password_hash, passwords, repeat(self.method), chunksize=chunksize,
+                    ))
+            finally:
+                for slot in extra:
+                    self._running.release(slot)
+
+    def verify(self, stored, password):
+        with self._slot():
+            return check_password_hash(stored, password)
+
+    def outdated(self, stored):
+        if self._prefix is None:
+            # werkzeug fills in defaults (e.g. iterations) which the configured method may omit
+            self._prefix = generate_password_hash('', self.method).split('$', 1)[0]
+        return stored.split('$', 1)[0] != self._prefix
+
+    @contextmanager
+    def _slot(self):
+        if not self.workers:
+            yield
+            return
+        queued = self._queued.acquire()
+        try:
+            running = self._running.acquire(wait=self.timeout)
+            try:
+                yield
+            finally:
+                self._running.release(running)
+        finally:
+            self._queued.release(queued)
+
+
+hasher = Hasher(
+    method=os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:50000'),
+    workers=int(os.environ.get('PASSWORD_WORKERS') or os.cpu_count()),
+    depth=int(os.environ.get('PASSWORD_QUEUE_DEPTH', 16)),
+)
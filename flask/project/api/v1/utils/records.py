@@ -0,0 +1,84 @@
+import ipaddress
+import struct
+from datetime import datetime, timezone
+
+# version, epoch microseconds, status code and the length of the endpoint name
+# followed by the endpoint name and a packed ip address (4 bytes for IPv4, 16
+# for IPv6, or nothing if the address is unknown)
+HEADER = struct.Struct('>BQHB')
+VERSION = 2
+# version 1 records had no endpoint name
+HEADER_V1 = struct.Struct('>BQH')
+
+
+def encode(time, ip, code, endpoint):
+    micros = int(time.float_timestamp * 1000000)
+    name = (endpoint or '').encode('utf-8')[:255]
+    return HEADER.pack(VERSION, micros, code, len(name)) + name + pack_ip(ip)
+
+
+def pack_ip(ip):
+    try:
+        return ipaddress.ip_address(ip).packed
+    except ValueError:
+        return b''
+
+
+def normalize_ip(ip):
+    try:
+        return str(ipaddress.ip_address(ip))
+    except ValueError:
+        return None
+
+
+def status_class(code):
+    return '%sxx' % (int(code) // 100)
+
+
+def decode(members):
+    """Decode a batch of members into dicts with ``time``, ``ip``, ``code`` and ``endpoint`` keys."""
+    addresses = {b'': None}
+    names = {}
+    times = {}
+    records = []
+    for member in members:
+        if member[0] == VERSION:
+            version, micros, code, length = HEADER.unpack_from(member)
+            name = member[HEADER.size:HEADER.size + length]
+            packed = member[HEADER.size + length:]
+        elif member[0] == 1:
+            version, micros, code = HEADER_V1.unpack_from(member)
+            name = b''
+            packed = member[HEADER_V1.size:]
+        else:
+            records.append(_decode_legacy(member))
+            continue
+        if packed not in addresses:
+            addresses[packed] = str(ipaddress.ip_address(packed))
+        if name not in names:
+            names[name] = name.decode('utf-8') or None
+        # requests arrive in bursts so many members share a timestamp
+        if micros not in times:
+            times[micros] = _isoformat(micros)
+        records.append({
+            'time': times[micros],
+            'ip': addresses[packed],
+            'code': code,
+            'endpoint': names[name],
+        })
+    return records
+
+
+def _isoformat(micros):
+    seconds, micros = divmod(micros, 1000000)
+    time = datetime.fromtimestamp(seconds, timezone.utc).replace(microsecond=micros)
+    return time.isoformat()
+
+
+def _decode_legacy(member):
+    # members written before the binary format were "<time> <ip> <code>"
+    args = member.decode('utf-8').split(' ', 2)
+    d = dict(zip(('time', 'ip', 'code'), args))
+    d['code'] = int(d['code'])
+    d['endpoint'] = None
+    return d
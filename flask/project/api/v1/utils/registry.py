@@ -0,0 +1,84 @@
+import time
+
+from ..dbs.redis import db as redis
+
+# every live token's jti scored by its expiration time
+EXPIRING = 'auth.sessions'
+
+
+def _token(jti):
+    return 'auth.tokens.%s' % jti
+
+
+def _sessions(identity):
+    return 'auth.sessions.%s' % identity
+
+
+def register(token, data, ttl):
+    pipe = redis.pipeline(transaction=False)
+    pipe.set(_token(data['jti']), token, ttl)
+    pipe.sadd(_sessions(data['identity']), data['jti'])
+    pipe.expire(_sessions(data['identity']), ttl)
+    pipe.zadd(EXPIRING, data['jti'], data['exp'])
+    # drop tokens which have since expired so the index stays small
+    pipe.zremrangebyscore(EXPIRING, '-inf', time.time())
+    pipe.execute()
+
+
+def revoke(identity, *jtis):
+    if jtis:
+        pipe = redis.pipeline(transaction=False)
+        pipe.delete(*map(_token, jtis))
+        pipe.srem(_sessions(identity), *jtis)
+        pipe.zrem(EXPIRING, *jtis)
+        pipe.execute()
+
+
+def revoke_all(identity):
+    """Revoke every token of the given identity and return their jtis."""
+    jtis = [jti.decode('utf-8') for jti in redis.smembers(_sessions(identity))]
+    revoke(identity, *jtis)
+    return jtis
+
+
+def page(low, skip, limit):
+    """Return up to ``limit`` live ``(expiration, jti, token)`` triples ordered by expiration.
+
+    The first ``skip`` jtis which expire at ``low`` are passed over. The
+    ``(low, skip)`` pair for the next page is returned alongside (or None).
+    """
+    now = time.time()
+    if low < now:
+        low, skip = now, 0
+    found = redis.zrangebyscore(EXPIRING, low, '+inf', start=skip, num=limit + 1, withscores=True)
+    found = [(exp, jti.decode('utf-8')) for jti, exp in found]
+    if len(found) > limit:
+        found = found[:limit]
+        last = found[-1][0]
+        seen = sum(1 for exp, jti in found if exp == last)
+        cursor = (last, seen + skip if last == low else seen)
+    else:
+        cursor = None
+    return _fetch(found), cursor
+
+
+def sessions(identity):
+    """Return every live ``(expiration, jti, token)`` triple of the given identity."""
+    jtis = [jti.decode('utf-8') for jti in redis.smembers(_sessions(identity))]
+    pipe = redis.pipeline(transaction=False)
+    for jti in jtis:
+        pipe.zscore(EXPIRING, jti)
+    now = time.time()
+    found = sorted((exp, jti) for exp, jti in zip(pipe.execute(), jtis) if exp and exp > now)
+    stale = set(jtis).difference(jti for exp, jti in found)
+    if stale:
+        revoke(identity, *stale)
+    return _fetch(found)
+
+
+def _fetch(found):
+    found = list(found)
+    if not found:
+        return []
+    tokens = redis.mget([_token(jti) for exp, jti in found])
+    return [(exp, jti, token) for (exp, jti), token in zip(found, tokens) if token is not None]
@@ -0,0 +1,91 @@
+import os
+import gzip
+
+from flask import Response, has_request_context, json as flask_json, request
+
+# optional backends - each is used if it's installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+JSON = 'application/json'
+MSGPACK = 'application/x-msgpack'
+
+
+def _json(data):
+    if orjson is not None:
+        return orjson.dumps(data, default=str, option=orjson.OPT_NON_STR_KEYS)
+    if ujson is not None:
+        return ujson.dumps(data, ensure_ascii=False).encode('utf-8')
+    return flask_json.dumps(data).encode('utf-8')
+
+
+def _msgpack(data):
+    return msgpack.packb(data, use_bin_type=True, default=str)
+
+
+class Serializer:
+    """Encode response bodies in the format and compression the client accepts."""
+
+    def __init__(self, compress_min=1024, gzip_level=6, zstd_level=3):
+        self.compress_min = compress_min
+        self.gzip_level = gzip_level
+        self.zstd_level = zstd_level
+        self.formats = {JSON: _json}
+        if msgpack is not None:
+            self.formats[MSGPACK] = _msgpack
+            # both names are in use for the same format
+            self.formats['application/msgpack'] = _msgpack
+        self.encodings = {'gzip': self._gzip}
+        if zstandard is not None:
+            # preferred when the client weighs both the same
+            self.encodings = {'zstd': self._zstd, 'gzip': self._gzip}
+
+    def response(self, status, data):
+        mimetype = self.negotiate()
+        body = self.formats[mimetype](data)
+        r = Response(body, status=status, mimetype=mimetype)
+        r.vary.add('Accept')
+        if len(body) >= self.compress_min:
+            r.vary.add('Accept-Encoding')
+            encoding = self.encoding()
+            if encoding is not None:
+                r.set_data(self.encodings[encoding](body))
+                r.content_encoding = encoding
+        return r
+
+    def negotiate(self):
+        if not has_request_context():
+            return JSON
+        return request.accept_mimetypes.best_match(list(self.formats), default=JSON)
+
+    def encoding(self):
+        if not has_request_context():
+            return None
+        return request.accept_encodings.best_match(list(self.encodings))
+
+    def _gzip(self, body):
+        return gzip.compress(body, self.gzip_level)
+
+    def _zstd(self, body):
+        return zstandard.ZstdCompressor(level=self.zstd_level).compress(body)
+
+
+serializer = Serializer(
+    compress_min=int(os.environ.get('RESPONSE_COMPRESS_MIN', 1024)),
+    gzip_level=int(os.environ.get('RESPONSE_GZIP_LEVEL', 6)),
+    zstd_level=int(os.environ.get('RESPONSE_ZSTD_LEVEL', 3)),
+)
@@ -0,0 +1,65 @@
+import multiprocessing
+import os
+import time
+
+from .msg import Unavailable
+
+
+class Slots:
+    """A limited number of slots shared by every worker forked after they were made.
+
+    Each slot holds a uwsgi worker - capping them leaves the rest of the
+    workers for other requests. Slots record the pid of their holder so that
+    those of a worker which died holding one are reclaimed.
+    """
+
+    def __init__(self, limit, retry_after=15, msg='Too many requests are in progress - try again later.'):
+        self.retry_after = retry_after
+        self.msg = msg
+        self.configure(limit)
+
+    def configure(self, limit):
+        # shared memory - this must happen before uwsgi forks its workers
+        self.limit = limit
+        self._holders = multiprocessing.Array('i', limit)
+
+    @property
+    def held(self):
+        with self._holders.get_lock():
+            return sum(1 for pid in self._holders if pid and _alive(pid))
+
+    def acquire(self, wait=0):
+        """Take a slot and return it - or raise :class:`Unavailable` if none frees up within ``wait`` seconds."""
+        deadline = time.monotonic() + wait
+        delay = 0.005
+        while True:
+            slot = self.take()
+            if slot is not None:
+                return slot
+            if time.monotonic() + delay > deadline:
+                raise Unavailable(self.msg, retry_after=self.retry_after)
+            time.sleep(delay)
+            delay = min(delay * 2, 0.1)
+
+    def take(self):
+        """Take a free slot and return it - or None if every slot is held."""
+        with self._holders.get_lock():
+            for slot, pid in enumerate(self._holders):
+                if not pid or not _alive(pid):
+                    self._holders[slot] = os.getpid()
+                    return slot
+        return None
+
+    def release(self, slot):
+        with self._holders.get_lock():
+            self._holders[slot] = 0
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
@@ -0,0 +1,72 @@
+import bisect
+import math
+
+# upper bounds (in seconds) of each latency bucket - from 1ms to ~46s
+LATENCY_BUCKETS = tuple(0.001 * 2 ** (i / 2) for i in range(32))
+
+MINUTE = 60
+HOUR = 60 * 60
+# how long (in seconds) rollups of each resolution are kept
+RETENTION = {MINUTE: 2 * 24 * HOUR, HOUR: 90 * 24 * HOUR}
+
+
+def key(endpoint, resolution, timestamp):
+    return 'stats:%s:%s:%s' % (endpoint, resolution, int(timestamp) // resolution * resolution)
+
+
+def rollups(endpoint, timestamp, code, duration):
+    """Yield the ``(key, field, ttl)`` counters a single request increments."""
+    for resolution, ttl in RETENTION.items():
+        k = key(endpoint, resolution, timestamp)
+        yield k, 'code:%s' % code, ttl
+        if duration is not None:
+            yield k, 'latency:%s' % bisect.bisect_left(LATENCY_BUCKETS, duration), ttl
+
+
+def keys(endpoint, start, stop):
+    """Keys covering ``start`` to ``stop`` - whole hours are read from hourly rollups."""
+    start = int(start) // MINUTE * MINUTE
+    stop = int(stop)
+    hourly = start < stop - RETENTION[MINUTE]
+    while start <= stop:
+        if hourly or (start % HOUR == 0 and start + HOUR <= stop):
+            yield key(endpoint, HOUR, start)
+            start = start // HOUR * HOUR + HOUR
+        else:
+            yield key(endpoint, MINUTE, start)
+            start += MINUTE
+
+
+def summarize(rollups, seconds):
+    codes, latency = {}, {}
+    for rollup in rollups:
+        for field, count in rollup.items():
+            kind, value = field.decode('utf-8').split(':', 1)
+            counts = codes if kind == 'code' else latency
+            counts[int(value)] = counts.get(int(value), 0) + int(count)
+    total = sum(codes.values())
+    return {
+        'requests': total,
+        'throughput': total / seconds if seconds else 0,
+        'codes': codes,
+        'latency': {
+            'p50': percentile(latency, 0.50),
+            'p95': percentile(latency, 0.95),
+            'p99': percentile(latency, 0.99),
+        },
+    }
+
+
+def percentile(histogram, q):
+    """The upper bound (in milliseconds) of the bucket holding the ``q`` quantile."""
+    total = sum(histogram.values())
+    if not total:
+        return None
+    rank = math.ceil(total * q)
+    seen = 0
+    for index in sorted(histogram):
+        seen += histogram[index]
+        if seen >= rank:
+            break
+    bound = LATENCY_BUCKETS[min(index, len(LATENCY_BUCKETS) - 1)]
+    return round(bound * 1000, 3)
@@ -0,0 +1,71 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from redis import RedisError
+
+from . import records
+
+logger = logging.getLogger(__name__)
+
+
+class Tail:
+    """Fan log records from one redis subscription out to every local listener."""
+
+    def __init__(self, db, channel, size=1000):
+        self.db = db
+        self.channel = channel
+        self.size = size
+        self._listeners = {}
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def listen(self, match):
+        self._start()
+        listener = queue.Queue(self.size)
+        with self._lock:
+            self._listeners[listener] = match
+        return listener
+
+    def forget(self, listener):
+        with self._lock:
+            self._listeners.pop(listener, None)
+
+    def _dispatch(self, member):
+        log = records.decode([member])[0]
+        line = json.dumps(log)
+        with self._lock:
+            listeners = list(self._listeners.items())
+        for listener, match in listeners:
+            if match(log):
+                try:
+                    listener.put_nowait(line)
+                except queue.Full:
+                    # a slow client only misses records - it never blocks the others
+                    pass
+
+    def _start(self):
+        # uwsgi forks workers after import - each one needs its own subscription
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    self._pid = pid
+                    self._listeners = {}
+                    thread = threading.Thread(target=self._run, daemon=True)
+                    thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                pubsub = self.db.node(self.channel).pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                for message in pubsub.listen():
+                    if message['type'] == 'message':
+                        self._dispatch(message['data'])
+            except RedisError:
+                logger.exception('Lost subscription to %r.', self.channel)
+                time.sleep(1)
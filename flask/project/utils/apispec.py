@@ -0,0 +1,68 @@
+"""Serve the OpenAPI spec compiled once instead of parsed from docstrings by every worker.
+
+flasgger builds the spec from the YAML in each view's docstring the first
+time a worker is asked for it. The spec is compiled to JSON either ahead of
+time:
+
+    python -m project.utils.apispec project/apispec.json
+
+or when the application is imported - before uwsgi forks its workers - and
+served with a strong ETag so that clients and nginx can revalidate it.
+"""
+import os
+import sys
+import json
+import hashlib
+from flask import Response, current_app, request
+
+
+class CompiledSpec:
+
+    def __init__(self, swagger, endpoint='apispec_1', path=None, max_age=3600):
+        self.swagger = swagger
+        self.endpoint = endpoint
+        self.path = path
+        self.max_age = max_age
+        self.body = None
+        self.etag = None
+
+    def load(self, fresh=False):
+        if not fresh and self.path and os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                body = f.read()
+        else:
+            body = compile_spec(self.swagger, self.endpoint)
+        self.body = body
+        self.etag = hashlib.sha256(body).hexdigest()
+
+    def view(self):
+        if current_app.debug:
+            # docstrings change while developing
+            self.load(fresh=True)
+        response = Response(self.body, mimetype='application/json')
+        response.set_etag(self.etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = self.max_age
+        return response.make_conditional(request)
+
+
+def serve(app, swagger, endpoint='apispec_1', path=None, max_age=3600):
+    """Replace the view of one of flasgger's specs with a compiled one."""
+    spec = CompiledSpec(swagger, endpoint, path, max_age)
+    with app.app_context():
+        spec.load()
+    app.view_functions['flasgger.' + endpoint] = spec.view
+    return spec
+
+
+def compile_spec(swagger, endpoint='apispec_1'):
+    spec = swagger.get_apispecs(endpoint)
+    return json.dumps(spec, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+if __name__ == '__main__':
+    from project import application, swagger
+    with application.app_context():
+        body = compile_spec(swagger)
+    with open(sys.argv[1], 'wb') as f:
+        f.write(body)
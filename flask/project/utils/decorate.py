@@ -1,6 +1,13 @@
+import json
 import inspect
-from flask import request
+import hashlib
+import logging
+from flask import current_app, make_response, request, Response
+from flask_jwt_extended import get_jwt_identity
 from functools import wraps
+from redis import RedisError
+
+logger = logging.getLogger(__name__)
 
 
 def arguments(signature):
@@ -24,3 +31,117 @@ def arguments(signature):
         return wrapper
 
     return setup
+
+
+# response headers which are stored along with cached bodies
+CACHED_HEADERS = ('Content-Type', 'Content-Encoding', 'Vary')
+
+
+def cached(ttl=60, tags=(), principal=True, when=None):
+    """Store a view's successful responses in redis and answer repeated requests from there.
+
+    Entries are keyed by endpoint, query arguments, the ``Accept`` headers and
+    (unless ``principal`` is false) the current identity - so place this below
+    ``authorization``. Passing any of ``tags`` to :func:`invalidate` expires
+    every entry made under it. ``when`` is called before each request and
+    skips the cache if it returns false.
+
+    Responses carry an ETag - an ``If-None-Match`` for it is answered with a
+    304 without reading the body.
+    """
+    def setup(function):
+
+        @wraps(function)
+        def wrapper(*a, **kw):
+            if request.method not in ('GET', 'HEAD') or (when is not None and not when()):
+                return function(*a, **kw)
+            db = current_app.extensions['cached']
+            identity = get_jwt_identity() if principal else None
+            try:
+                key = _cache_key(db, identity, tags)
+                found = _cache_get(db, key)
+            except RedisError:
+                logger.exception('Could not read the response cache.')
+                return function(*a, **kw)
+            if found is not None:
+                found.headers['X-Cache'] = 'hit'
+                return found.make_conditional(request)
+            response = make_response(function(*a, **kw))
+            if response.status_code == 200 and not response.is_streamed:
+                try:
+                    _cache_set(db, key, response, ttl)
+                except RedisError:
+                    logger.exception('Could not write the response cache.')
+                response.headers['X-Cache'] = 'miss'
+            return response.make_conditional(request)
+
+        return wrapper
+
+    return setup
+
+
+def invalidate(*tags):
+    """Expire every response cached under any of the given tags."""
+    if tags:
+        pipe = current_app.extensions['cached'].pipeline(transaction=False)
+        for tag in tags:
+            pipe.incr(_tag(tag))
+        pipe.execute()
+
+
+def _tag(name):
+    return 'cache.tags.%s' % name
+
+
+def _cache_key(db, identity, tags):
+    # entries made before a tag was invalidated are never looked up again
+    versions = [int(v or 0) for v in db.mget(*map(_tag, tags))] if tags else []
+    parts = [
+        request.endpoint,
+        sorted(request.args.items(multi=True)),
+        identity,
+        versions,
+        request.headers.get('Accept'),
+        request.headers.get('Accept-Encoding'),
+    ]
+    digest = hashlib.sha256(json.dumps(parts).encode('utf-8')).hexdigest()
+    return 'cache.responses.%s' % digest
+
+
+def _cache_get(db, key):
+    if request.if_none_match:
+        meta = db.hget(key, 'meta')
+        if meta is None:
+            return None
+        meta = json.loads(meta.decode('utf-8'))
+        if request.if_none_match.contains(meta['etag']):
+            # the client has this body already - make_conditional turns this into a 304
+            return _cache_response(meta, b'')
+    meta, body = db.hmget(key, 'meta', 'body')
+    if meta is None or body is None:
+        return None
+    return _cache_response(json.loads(meta.decode('utf-8')), body)
+
+
+def _cache_response(meta, body):
+    response = Response(body, status=meta['status'], headers=meta['headers'])
+    response.set_etag(meta['etag'])
+    response.cache_control.no_cache = True
+    return response
+
+
+def _cache_set(db, key, response, ttl):
+    body = response.get_data()
+    etag = hashlib.sha256(body).hexdigest()
+    meta = {
+        'status': response.status_code,
+        'headers': [[k, response.headers[k]] for k in CACHED_HEADERS if k in response.headers],
+        'etag': etag,
+    }
+    pipe = db.pipeline(transaction=False)
+    pipe.hmset(key, {'meta': json.dumps(meta), 'body': body})
+    pipe.expire(key, ttl)
+    pipe.execute()
+    response.set_etag(etag)
+    # clients should revalidate rather than reuse it unasked
+    response.cache_control.no_cache = True
@@ -1,38 +1,67 @@
-import os
-import types
+"""Find the blueprints of a package and register them with an application.
+
+Walking packages for blueprints imports every package below the included
+one, which is slow enough to matter when uwsgi keeps spawning workers. The
+walk's result can be written to a manifest once:
+
+    python -m project.utils.loading project.api.v1 > project/blueprints.json
+
+and workers then import only the modules it lists. Regenerate it whenever a
+blueprint is added, moved or removed.
+"""
+import sys
+import json
 import pkgutil
 import inspect
-import importlib.util
+import argparse
+import importlib
 from flask import Blueprint
 
 
-def load_blueprints(app, include):
-    for bp in iter_blueprints(include):
+def load_blueprints(app, include, package=None, manifest=None):
+    for bp in iter_blueprints(include, package, manifest):
         app.register_blueprint(bp)
 
 
-def iter_blueprints(include):
+def iter_blueprints(include, package=None, manifest=None):
     if include.startswith('.'):
-        include = _calling_frame().f_globals['__name__'] + include
+        if package is None:
+            package = _calling_frame().f_globals['__name__']
+        include = package + include
+    paths = _read_manifest(manifest, include) if manifest else None
+    if paths is None:
+        paths = blueprint_paths(include)
+    for path in paths:
+        module, name = path.split(':')
+        yield getattr(importlib.import_module(module), name)
+
+
+def blueprint_paths(include):
+    """Return ``module:name`` paths of the blueprints in the given package and the packages below it."""
+    seen = set()
+    paths = []
     for module in _iter_packages(include):
         for k, v in vars(module).items():
-            if isinstance(v, Blueprint):
-                yield v
+            if isinstance(v, Blueprint) and id(v) not in seen:
+                seen.add(id(v))
+                paths.append('%s:%s' % (module.__name__, k))
+    return paths
 
 
 def _iter_packages(include):
-    spec = importlib.util.find_spec(include)
-    if spec is None:
-        raise ImportError("Could not find module spec for '%s'." % include)
-    yield spec.loader.load_module()
-    search_paths = list(map(
-        lambda s: os.path.join(os.getcwd(), s),
-        spec.submodule_search_locations
-    ))
-    for finder, name, ispkg in pkgutil.walk_packages(search_paths):
+    module = importlib.import_module(include)
+    yield module
+    for finder, name, ispkg in pkgutil.iter_modules(module.__path__):
         if ispkg:
-            fullname = include + '.' + name
-            yield from _iter_packages(fullname)
+            yield from _iter_packages(include + '.' + name)
+
+
+def _read_manifest(path, include):
+    try:
+        with open(path) as f:
+            return json.load(f).get(include)
+    except FileNotFoundError:
+        return None
 
 
 def _calling_frame():
@@ -40,3 +69,11 @@ def _calling_frame():
     while frame.f_globals['__name__'] == __name__:
         frame = frame.f_back
     return frame
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Print a blueprint manifest for the given packages.')
+    parser.add_argument('include', nargs='+', help='absolute package names, e.g. project.api.v1')
+    args = parser.parse_args()
+    json.dump({include: blueprint_paths(include) for include in args.include}, sys.stdout, indent=4)
+    sys.stdout.write('\n')